@@ -0,0 +1,200 @@
+"""
+Admission control: per-client rate limits and a cap on requests in flight.
+
+Every request spends a token from the token bucket of its route for its IP
+address, IP_BUDGET_FACTOR times larger than a client's budget so people
+behind one campus NAT are not limited as a single client; a signed-in
+request also spends one from its user's own bucket (keyed by the JWT `sub`). A request finding either bucket empty is
+answered 429 with the seconds until a token is back in Retry-After.
+Admitted requests then need a slot under MAX_IN_FLIGHT; when the process
+is already that busy the request is shed with 503 instead of queueing
+behind the others. Both are per process, like the caches and metrics.
+
+Environment:
+    RATE_LIMITS    Route budgets overriding ROUTE_BUDGETS, as
+                   "endpoint=rate/burst" pairs with the rate in requests
+                   per second, e.g. "user_search=0.05/5,get_products=10/40".
+    RATE_LIMITING  "0" turns the rate limits off (e.g. for load tests).
+    MAX_IN_FLIGHT  Requests handled at once per process before shedding
+                   (default 24, below the 32 threads of a worker; 0 disables).
+"""
+
+import math
+import os
+import threading
+import time
+from collections import namedtuple
+from cachetools import LRUCache
+import metrics
+
+# Sustained requests per second and burst size of a bucket
+Budget = namedtuple("Budget", ["rate", "burst"])
+
+DEFAULT_BUDGET = Budget(10, 50)
+
+# Budgets per Flask endpoint; routes costing a third-party call or an email are the tightest
+ROUTE_BUDGETS = {
+    "get_products": Budget(5, 30),
+    "search_products": Budget(5, 20),
+    "get_similar_products": Budget(5, 20),
+    "signin": Budget(0.2, 10),
+    "user_search": Budget(0.1, 10),
+    "add_listing": Budget(0.2, 10),
+    "update_product": Budget(0.5, 10),
+    "delete_listing": Budget(0.5, 10),
+    "bulk_add_listings": Budget(1 / 60, 2),
+    "export_listings": Budget(1 / 60, 2),
+    "upload_listing_photo": Budget(0.1, 5),
+    "upload_profile_photo": Budget(0.1, 5),
+    "count_product_view": Budget(2, 20),
+    "count_product_order": Budget(0.2, 5),
+}
+
+# Endpoints never limited: scrapes must work under load, and images are static files
+EXEMPT_ENDPOINTS = frozenset(("get_metrics", "serve_image", "static"))
+
+# How much more an IP address may send than a single client
+IP_BUDGET_FACTOR = 4
+
+# Buckets kept; the least recently used are dropped, which only refills them
+MAX_TRACKED_KEYS = 100000
+
+RATE_LIMITING = os.environ.get("RATE_LIMITING", "1") == "1"
+MAX_IN_FLIGHT = int(os.environ.get("MAX_IN_FLIGHT", "24"))
+
+# Retry-After sent with 503 when shedding load
+SHED_RETRY_SECONDS = 1
+
+LIMITED = "rate_limited"
+SHED = "overloaded"
+
+Rejection = namedtuple("Rejection", ["status", "reason", "retry_after"])
+
+
+def parse_budgets(value):
+    """
+    Parse RATE_LIMITS overrides.
+    Args:
+        value (str): "endpoint=rate/burst" pairs separated by commas.
+    Returns:
+        dict: Endpoint -> Budget.
+    Raises:
+        ValueError: If a pair is malformed.
+    """
+    budgets = {}
+    for part in (value or "").split(","):
+        if not part.strip():
+            continue
+        try:
+            endpoint, setting = part.split("=", 1)
+            rate, burst = setting.split("/", 1)
+            budgets[endpoint.strip()] = Budget(float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid RATE_LIMITS entry: {part}")
+    return budgets
+
+
+class TokenBuckets:
+    """Token buckets keyed by client, refilled lazily from the time of their last use."""
+
+    def __init__(self, maxsize=MAX_TRACKED_KEYS):
+        """Create an empty set of buckets; an unknown key starts with a full bucket."""
+        self._buckets = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of buckets tracked."""
+        return len(self._buckets)
+
+    def take(self, requests, now=None):
+        """
+        Spend one token from each bucket, only if every one of them has a token.
+        Args:
+            requests (list): (key, Budget) pairs.
+            now (float): Monotonic time; the current time by default.
+        Returns:
+            float: 0 if the tokens were spent, else seconds until all buckets have one.
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            levels = []
+            for key, budget in requests:
+                bucket = self._buckets.get(key)
+                tokens = budget.burst if bucket is None else min(budget.burst, bucket[0] + (now - bucket[1]) * budget.rate)
+                levels.append((key, budget, tokens))
+            waits = [(1 - tokens) / budget.rate for _, budget, tokens in levels if tokens < 1]
+            spent = 0 if waits else 1
+            for key, _, tokens in levels:
+                self._buckets[key] = (tokens - spent, now)
+            return max(waits, default=0.0)
+
+
+class AdmissionController:
+    """Decides whether a request is handled, limited (429) or shed (503)."""
+
+    def __init__(self, budgets=None, rate_limiting=RATE_LIMITING, max_in_flight=MAX_IN_FLIGHT):
+        """Create a controller with ROUTE_BUDGETS updated by budgets."""
+        self.budgets = {**ROUTE_BUDGETS, **(budgets or {})}
+        self.rate_limiting = rate_limiting
+        self.max_in_flight = max_in_flight
+        self.buckets = TokenBuckets()
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.limited = 0
+        self.shed = 0
+
+    def admit(self, endpoint, ip, sub=None):
+        """
+        Admit a request or say why not. An admitted request must be released.
+        Args:
+            endpoint (str): The Flask endpoint, or None for unmatched URLs;
+                EXEMPT_ENDPOINTS are not passed here at all.
+            ip (str): The client's address.
+            sub (str): The signed-in user's Google sub, if any.
+        Returns:
+            Rejection: Why the request is refused, or None if it was admitted.
+        """
+        wait = 0
+        if self.rate_limiting:
+            budget = self.budgets.get(endpoint, DEFAULT_BUDGET)
+            ip_budget = Budget(budget.rate * IP_BUDGET_FACTOR, budget.burst * IP_BUDGET_FACTOR)
+            buckets = [((endpoint, "ip", ip), ip_budget)]
+            if sub:
+                buckets.append(((endpoint, "user", sub), budget))
+            wait = self.buckets.take(buckets)
+        with self._lock:
+            if wait:
+                self.limited += 1
+                rejection = Rejection(429, LIMITED, max(1, math.ceil(wait)))
+            elif self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.shed += 1
+                rejection = Rejection(503, SHED, SHED_RETRY_SECONDS)
+            else:
+                self.in_flight += 1
+                self.admitted += 1
+                return None
+        metrics.admission_rejections.inc(endpoint=endpoint, reason=rejection.reason)
+        return rejection
+
+    def release(self):
+        """Free the slot of an admitted request once it is finished."""
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        """Return the admission counters."""
+        with self._lock:
+            return {
+                "inFlight": self.in_flight,
+                "maxInFlight": self.max_in_flight,
+                "rateLimiting": self.rate_limiting,
+                "admitted": self.admitted,
+                "limited": self.limited,
+                "shed": self.shed,
+                "trackedClients": len(self.buckets),
+            }
+
+
+# Shared per-process controller
+controller = AdmissionController(parse_budgets(os.environ.get("RATE_LIMITS")))
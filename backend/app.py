@@ -1,44 +1,106 @@
-from flask import Flask, Response, abort, jsonify, redirect, request, session, url_for
+from flask import Flask, Response, abort, g, jsonify, redirect, request, send_from_directory, session, stream_with_context, url_for
 from flask_cors import CORS
-from database import db
+from werkzeug.middleware.proxy_fix import ProxyFix
 from db_class import User, Item
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from environment import GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET
 from datetime import datetime
 from admin_list import admin_list
 from email_sender import send_email
+import email_sender
+import notifications
+import counters
+import admission
+import documents
+from image_storage import MAX_UPLOAD_BYTES, LocalImageStorage, UploadError, create_storage
+import http_client
+import bulk_io
+import db_config
+import log_config
+import logging
+import time
+import uuid
+import metrics
+import query_detector
+from profiler import SamplingProfiler
+import threading
+import io
+from google_certs import CertificateCache as GoogleCertificateCache
 import jwt
 import os
-import requests
-import base64
 import json
 
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from db_class import DBClass
+from db_class import DBClass, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from cache import product_cache, user_cache
+import similar
+import versions
+import hashlib
 import os
 
+# JSON logs written from a background thread, see log_config.py
+log_config.configure()
+logger = logging.getLogger(__name__)
+# One record per request, sampled with LOG_SAMPLING="access=<fraction>"
+access_log = logging.getLogger("access")
+
 app = Flask(__name__)
 app.secret_key = "super secure secret key"
 
-# Database configuration
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///spartanswap.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+# Behind a reverse proxy, client addresses (used by the rate limits) come from
+# X-Forwarded-For; TRUSTED_PROXIES is the number of proxies in front
+if int(os.environ.get("TRUSTED_PROXIES", "0")):
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=int(os.environ["TRUSTED_PROXIES"]))
+
+# N+1 query detection: "off", "log" or "raise" (on by default under the dev server)
+query_detector.configure(os.environ.get("QUERY_DETECTOR", query_detector.OFF))
+
+# Database configuration, from DATABASE_URL
+db_config.configure_app(app)
+
+# Where uploaded photos are stored
+image_store = create_storage(app.instance_path)
+# Request bodies are refused (413) past one photo plus its form encoding, before
+# they are spooled to disk; the bulk import raises its own limit
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_BYTES + 64 * 1024
 
 # Initialize the database
 with app.app_context():
     db_instance = DBClass(app)
-    db_instance.db.create_all() 
 
 # Configure CORS
 CORS(app, origins=["http://localhost:3000"], supports_credentials=True)
 
+# Google's signing certificates, cached and refreshed in the background so
+# sign-in verifies ID tokens without a network round-trip
+google_certificates = GoogleCertificateCache()
 
-# Create tables on startup
-with app.app_context():
-    db_instance.db.create_all()
+
+def start_services():
+    """
+    Create the tables and start the background workers of this process.
+    Called by the process that serves requests (the dev server below, each
+    gunicorn worker in serve.py) rather than at import, so processes that
+    merely import this module, such as the image variant pool re-importing
+    the main module, start nothing.
+    """
+    with app.app_context():
+        existed = os.path.exists('instance/spartanswap.db')
+        db_instance.create_tables()
+        if existed:
+            logger.info("Using existing database")
+        else:
+            logger.info("Created new database")
+        # Deliver emails from a background worker pool instead of inside requests
+        email_sender.configure(db_instance.engine)
+        # Tell sellers who looked them up in periodic digests
+        notifications.configure(db_instance.engine)
+        # Write order and view counts in periodic batches
+        counters.configure(db_instance.engine)
+    # Build the similar-items index in the background, off the request path
+    similar.index.ensure_fresh(db_instance.engine)
+    google_certificates.start()
 
 # OAuth 2 client setup
 # client = WebApplicationClient(GOOGLE_CLIENT_ID)
@@ -51,25 +113,15 @@ def validate_session(token, is_admin=False):
         token (str): The JWT token to validate.
         is_admin (bool): Flag to check if the user is an admin.
     Returns:
-        dict: User data if valid, False otherwise.
+        UserSnapshot: Read-only user data if valid, False otherwise.
     """
     try:
         data = jwt.decode(token, app.secret_key, algorithms=["HS256"])
-        user = db_instance.get_user_by_sub(data["sub"])
-        #print("right here willis: ", type(user))
+        user = db_instance.get_cached_user(data["sub"])
         if user:
             # Check if the user is an admin
             if is_admin and not user.is_admin:
                 return False
-            
-            user_data = {
-                "id": user.id,
-                "name": user.name,
-                "email": user.email,
-                "profile_picture": user.profile_picture,
-                "is_admin": user.is_admin,
-            }
-            #return user_data
             return user
         else:
             return False
@@ -111,9 +163,7 @@ def signin():
 
     try:
         token = request.form["credential"]
-        idinfo = id_token.verify_oauth2_token(
-            token, google_requests.Request(), GOOGLE_CLIENT_ID
-        )
+        idinfo = google_certificates.verify(token, GOOGLE_CLIENT_ID)
 
         # jsonify returns a response object
         return_data = {}
@@ -124,14 +174,14 @@ def signin():
         if "hd" not in idinfo:
             return_data["CWRU_validated"] = False
         elif idinfo["hd"] == "case.edu":
-            if db_instance.get_user_by_sub(idinfo["sub"]) is None:
-                db_instance.add_user(
-                    sub=idinfo["sub"],
-                    email=idinfo["email"],
-                    name=idinfo["name"],
-                    profile_picture=idinfo["picture"],
-                    is_admin=idinfo["email"] in admin_list,
-                )
+            user, created = db_instance.get_or_create_user(
+                sub=idinfo["sub"],
+                email=idinfo["email"],
+                name=idinfo["name"],
+                profile_picture=idinfo["picture"],
+                is_admin=idinfo["email"] in admin_list,
+            )
+            if created:
                 send_email(
                     idinfo["email"],
                     "Welcome to SpartanSwap!",
@@ -141,7 +191,7 @@ def signin():
             return_data["jwt_token"] = jwt.encode(
                 {
                     "sub": idinfo["sub"],
-                    "id": db_instance.get_user_by_sub(idinfo["sub"]).id,
+                    "id": user.id,
                     "name": idinfo["name"],
                     "iat": datetime.now().timestamp(),
                     "exp": datetime.now().timestamp() + 604800,
@@ -153,8 +203,8 @@ def signin():
         else:
             return_data["CWRU_validated"] = False
         return jsonify(return_data)
-    except Exception as e:
-        print(e)
+    except Exception:
+        logger.warning("Sign-in rejected", exc_info=True)
         abort(403)
 
 
@@ -162,36 +212,232 @@ def signin():
 # def callback():
 #     return "Google login test"
 
-# Replace the existing initialization with:
-with app.app_context():
-    # Explicitly create all tables
-    #db_instance.db.drop_all()
-    if not os.path.exists('instance/spartanswap.db'):
-        db_instance.db.create_all()
-        print("Created new database")
+# Test data, for reference:
+# db_instance.add_user(
+#     sub="test-user-123",
+#     email="test@case.edu",
+#     name="Test User"
+# )
+# db_instance.add_item(
+#     seller_id=1,  # Matches the test user's ID
+#     item_type="Furniture",
+#     category="Home Goods",
+#     color="Green",
+#     price=199.23,
+#     condition="New",
+#     name="Test Item",
+#     orders=24,
+#     description="Test description",
+#     is_custom=True
+# )
+
+
+@app.before_request
+def start_request_metrics():
+    """Start timing the request, and profile it if an admin asked with ?__profile=1."""
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    metrics.start_request()
+    query_detector.start_request()
+    if request.args.get("__profile") == "1" and validate_session(request.cookies.get("jwt_token"), is_admin=True):
+        g.profiler = SamplingProfiler(threading.get_ident())
+        g.profiler.start()
+
+def request_sub():
+    """The Google sub in the request's JWT cookie, checked without a database lookup, or None."""
+    token = request.cookies.get("jwt_token")
+    if not token:
+        return None
+    try:
+        return jwt.decode(token, app.secret_key, algorithms=["HS256"]).get("sub")
+    except jwt.InvalidTokenError:
+        return None
+
+@app.before_request
+def admit_request():
+    """Refuse the request with 429 or 503 if its client is over budget or the process is saturated."""
+    # CORS preflights are answered without running the route, so they spend no tokens
+    if request.method == "OPTIONS" or request.endpoint in admission.EXEMPT_ENDPOINTS:
+        return None
+    rejection = admission.controller.admit(request.endpoint, request.remote_addr, request_sub())
+    if rejection is None:
+        g.admitted = True
+        return None
+    if rejection.status == 429:
+        response = jsonify({"error": "Too many requests, try again later"})
     else:
-        print("Using existing database")
-    
-    """ # Create a test user first
-    db_instance.add_user(
-        sub="test-user-123",
-        email="test@case.edu",
-        name="Test User"
-    ) """
-    
-    # Then add the test item
-    """ db_instance.add_item(
-        seller_id=1,  # Matches the test user's ID
-        item_type="Furniture",
-        category="Home Goods",
-        color="Green",
-        price=199.23,
-        condition="New",
-        name="Test Item",
-        orders=24,
-        description="Test description",
-        is_custom=True
-    ) """
+        response = jsonify({"error": "Server busy, try again shortly"})
+    response.status_code = rejection.status
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response
+
+@app.teardown_request
+def release_request(exception):
+    """Free the admitted request's slot, however it ended."""
+    if g.pop("admitted", False):
+        admission.controller.release()
+
+@app.after_request
+def finish_request_metrics(response):
+    """Record the request's metrics; a profiled request returns its stack samples instead."""
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        response = Response(profiler.folded(), mimetype="text/plain")
+        response.headers["X-Profile-Seconds"] = f"{profiler.seconds:.6f}"
+        response.headers["X-Profile-Samples"] = str(sum(profiler.samples.values()))
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.finish_request(route, request.method, response.status_code)
+    response.headers["X-Request-ID"] = g.request_id
+    access_log.info("request", extra={
+        "method": request.method,
+        "route": route,
+        "status": response.status_code,
+        "duration_ms": round((time.perf_counter() - g.request_started) * 1000, 2),
+        "sql_statements": g.get("sql_statements"),
+    })
+    return response
+
+
+# Listing sorts ordered by the write-behind counters, see counters.py
+POPULARITY_SORTS = ("popular", "most_viewed")
+
+# Columns serialize_item reads, selected by the streaming product listing
+PRODUCT_COLUMNS = tuple(Item.__table__.c[column] for column in documents.COLUMNS)
+
+
+def serialize_item(item):
+    """
+    Convert an Item into the JSON shape used by the frontend.
+    Lists use the precomputed documents instead, see product_list_json.
+    Args:
+        item (Item): The item to serialize.
+        Any object with the column attributes works, including result rows.
+    Returns:
+        dict: The product data.
+    """
+    return documents.serialize(item)
+
+
+def seller_json(seller):
+    """The embedded form of a SellerSummary, or None for an unknown seller."""
+    if seller is None:
+        return None
+    return {"id": seller.id, "name": seller.name, "profilePicture": seller.profile_picture}
+
+
+def embed_sellers(products):
+    """
+    Add each product's seller summary, loaded with one query for the whole list.
+    Returns new dicts, so cached payloads are left as they are.
+    """
+    sellers = db_instance.get_seller_summaries(product["sellerId"] for product in products)
+    return [{**product, "seller": seller_json(sellers.get(product["sellerId"]))} for product in products]
+
+
+def product_list_json(product_documents):
+    """
+    Join precomputed product documents into the text of a JSON array.
+    With `embed=seller`, each seller summary is spliced into its document.
+    Args:
+        product_documents (list): ProductDocuments.
+    Returns:
+        str: The JSON array.
+    """
+    if not wants_sellers():
+        return documents.join(document.body for document in product_documents)
+    sellers = db_instance.get_seller_summaries(document.seller_id for document in product_documents)
+    return documents.join(
+        document.body[:-1] + ',"seller":' + json.dumps(seller_json(sellers.get(document.seller_id))) + "}"
+        for document in product_documents
+    )
+
+
+def json_response(body):
+    """Wrap JSON text that is already serialized in a response."""
+    return app.response_class(body, mimetype="application/json")
+
+
+def wants_sellers():
+    """Check whether the request asked for seller summaries with `embed=seller`."""
+    return "seller" in _multi_value_arg("embed")
+
+
+def version_stamp(scopes, stamps=None):
+    """
+    Compute the validators of a response built from the given data partitions.
+    Args:
+        scopes (list): Partition names the response depends on, see versions.py.
+        stamps (dict): The partitions' counters if already read, see DBClass.get_versions.
+    Returns:
+        tuple: (ETag value, Last-Modified datetime or None)
+    """
+    if stamps is None:
+        stamps = db_instance.get_versions(scopes)
+    raw = repr((request.full_path, sorted((scope, version) for scope, (version, _) in stamps.items())))
+    etag = hashlib.sha1(raw.encode()).hexdigest()
+    modified = [modified_at for _, modified_at in stamps.values() if modified_at]
+    return etag, max(modified) if modified else None
+
+
+def is_not_modified(etag, last_modified):
+    """Check the request's If-None-Match / If-Modified-Since against the validators."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified:
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified, private=False):
+    """Attach ETag/Last-Modified and require revalidation on every use."""
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache" if private else "no-cache"
+    return response
+
+
+def not_modified_response(etag, last_modified, private=False):
+    """Build an empty 304 response carrying the validators."""
+    return with_validators(Response(status=304), etag, last_modified, private)
+
+
+def _multi_value_arg(name):
+    """Read a query parameter given repeatedly and/or comma separated as a list."""
+    values = []
+    for raw in request.args.getlist(name):
+        values.extend(value.strip() for value in raw.split(",") if value.strip())
+    return values
+
+
+def parse_item_filters():
+    """
+    Read the facet filters of a product listing request.
+    Query parameters: `minPrice`, `maxPrice`, `condition`, `color`, `type`
+    (multi-valued) and `isCustom` (true/false).
+    Returns:
+        dict: Filters in the form DBClass._filter_items expects.
+    Raises:
+        ValueError: If a parameter is malformed.
+    """
+    filters = {
+        "conditions": _multi_value_arg("condition"),
+        "colors": _multi_value_arg("color"),
+        "item_types": _multi_value_arg("type"),
+    }
+    for arg, key in (("minPrice", "min_price"), ("maxPrice", "max_price")):
+        if request.args.get(arg):
+            try:
+                filters[key] = float(request.args[arg])
+            except ValueError:
+                raise ValueError(f"{arg} must be a number")
+    is_custom = request.args.get("isCustom")
+    if is_custom:
+        if is_custom.lower() not in ("true", "false", "1", "0"):
+            raise ValueError("isCustom must be true or false")
+        filters["is_custom"] = is_custom.lower() in ("true", "1")
+    return filters
 
 
 @app.route("/api/products", methods=["GET"])
@@ -199,34 +445,280 @@ def get_products():
     # docstring
     """
     Get all products based on seller ID or category.
+    Passing `limit` or `cursor` switches to keyset pagination, sorted by `sort`
+    (newest, price_asc, price_desc, popular or most_viewed), and the page also carries the
+    facet counts for the category. Passing `ids` (comma separated) fetches just
+    those products. Passing `stream=1` streams the full list in constant
+    memory. Passing `embed=seller` adds each product's seller summary (not
+    when streaming). See parse_item_filters for the facet filters.
     Returns:
-        Response: JSON response containing the list of products.
+        Response: JSON response containing the list of products, or a page of
+        products, the cursor for the next page and the facet counts.
     """
 
+    ids = request.args.get("ids")
+    if ids is not None:
+        try:
+            item_ids = list(dict.fromkeys(int(i) for i in ids.split(",") if i.strip()))
+        except ValueError:
+            return jsonify({"error": "ids must be a comma separated list of integers"}), 400
+        if len(item_ids) > MAX_PAGE_SIZE:
+            return jsonify({"error": f"At most {MAX_PAGE_SIZE} ids per request"}), 400
+        return json_response(product_list_json(db_instance.get_items_by_ids(item_ids, as_documents=True)))
+
     seller_id = request.args.get("sellerId")
-    if seller_id:
-        items = db_instance.get_all_items(seller_id=seller_id)
+    category = None if seller_id else request.args.get("category")
+    try:
+        filters = parse_item_filters()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    paginated = "limit" in request.args or "cursor" in request.args
+    if paginated:
+        # Pages carry facet counts that span every category
+        scope = versions.ALL_ITEMS
+    elif seller_id:
+        scope = versions.seller_scope(seller_id)
+    elif category:
+        scope = versions.category_scope(category)
     else:
-        category = request.args.get('category')
-        items = db_instance.get_all_items(category=category)
-    
-    products = []
-    for item in items:
-        product_data = {
-            "id": item.id,
-            "sellerId": item.seller_id,
-            "name": item.name,
-            "price": item.price,
-            "orders": item.orders,
-            "image": item.image_url if item.image_url else "/essentials.jpg",
-            "type": item.item_type,
-            "color": item.color,
-            "category": item.category,
-            "description": item.description,
-            "isCustom": item.is_custom
-        }
-        products.append(product_data)
-    return jsonify(products)
+        scope = versions.ALL_ITEMS
+    item_scopes = [scope]
+    if paginated and request.args.get("sort") in POPULARITY_SORTS:
+        item_scopes.append(versions.POPULARITY)
+    scopes = item_scopes + [versions.ALL_USERS] if wants_sellers() else item_scopes
+    stamps = db_instance.get_versions(scopes)
+    etag, last_modified = version_stamp(scopes, stamps)
+    if is_not_modified(etag, last_modified):
+        return not_modified_response(etag, last_modified)
+
+    if request.args.get("stream") == "1" and not paginated:
+        # Column rows serialized one at a time straight into the response
+        rows = db_instance.iter_item_rows(
+            category=category, seller_id=seller_id, filters=filters, columns=PRODUCT_COLUMNS
+        )
+        body = bulk_io.write_json_array(serialize_item(row) for row in rows)
+        response = Response(stream_with_context(body), mimetype="application/json")
+        return with_validators(response, etag, last_modified)
+
+    cache_key = (
+        # The cache is per process and only evicted by the process that made a
+        # change, so entries are keyed by the version the ETag was computed from
+        tuple(stamps[item_scope][0] for item_scope in item_scopes),
+        paginated,
+        category,
+        seller_id,
+        request.args.get("sort", "newest"),
+        request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+        request.args.get("cursor"),
+        tuple(sorted((key, tuple(sorted(value)) if isinstance(value, list) else value)
+                     for key, value in filters.items())),
+    )
+    payload = product_cache.get(cache_key)
+
+    if paginated:
+        if payload is None:
+            try:
+                items, next_cursor = db_instance.get_items_page(
+                    category=category,
+                    seller_id=seller_id,
+                    sort=request.args.get("sort", "newest"),
+                    limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+                    cursor=request.args.get("cursor"),
+                    filters=filters,
+                    as_documents=True,
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            payload = (items, next_cursor)
+            product_cache.set(cache_key, payload, category=category, seller_id=seller_id)
+        items, next_cursor = payload
+        # Facet counts span categories, so they are read fresh rather than cached
+        body = (
+            '{"products":' + product_list_json(items)
+            + ',"nextCursor":' + json.dumps(next_cursor)
+            + ',"facets":' + json.dumps(db_instance.get_facet_counts(category)) + "}"
+        )
+        return with_validators(json_response(body), etag, last_modified)
+
+    if payload is None:
+        if seller_id:
+            payload = db_instance.get_all_items(seller_id=seller_id, filters=filters, as_documents=True)
+        else:
+            payload = db_instance.get_all_items(category=category, filters=filters, as_documents=True)
+        product_cache.set(cache_key, payload, category=category, seller_id=seller_id)
+    return with_validators(json_response(product_list_json(payload)), etag, last_modified)
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    # docstring
+    """
+    Get the hit/miss counters of the product listing and user caches. Admin only.
+    Returns:
+        Response: JSON response containing the cache statistics.
+    """
+
+    token = request.cookies.get("jwt_token")
+    if not validate_session(token, is_admin=True):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify({"products": product_cache.stats(), "users": user_cache.stats()})
+
+@app.route("/api/outbound_stats", methods=["GET"])
+def outbound_stats():
+    # docstring
+    """
+    Get call counts, latency and circuit state of the third-party HTTP clients. Admin only.
+    Returns:
+        Response: JSON response mapping each service to its metrics.
+    """
+
+    token = request.cookies.get("jwt_token")
+    if not validate_session(token, is_admin=True):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(http_client.all_stats())
+
+@app.route("/api/admission_stats", methods=["GET"])
+def admission_stats():
+    # docstring
+    """
+    Get the requests in flight and the counts of admitted, rate limited and shed requests. Admin only.
+    Returns:
+        Response: JSON response containing the admission counters.
+    """
+
+    token = request.cookies.get("jwt_token")
+    if not validate_session(token, is_admin=True):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(admission.controller.stats())
+
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    # docstring
+    """
+    Expose request, SQL, cache and outbound call metrics in the Prometheus text format.
+    When METRICS_TOKEN is set, scrapers must send it as a bearer token.
+    Returns:
+        Response: The metrics of this process.
+    """
+
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 403
+    body = metrics.render({"products": product_cache.stats(), "users": user_cache.stats()})
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route("/api/products/facets", methods=["GET"])
+def get_product_facets():
+    # docstring
+    """
+    Get the precomputed facet counts for a category, or the whole catalog.
+    Returns:
+        Response: JSON response mapping each facet to its value counts.
+    """
+
+    return jsonify(db_instance.get_facet_counts(request.args.get("category")))
+
+@app.route("/api/products/<int:product_id>", methods=["GET"])
+def get_product(product_id):
+    # docstring
+    """
+    Get a single product by its ID. Passing `embed=seller` adds the seller summary.
+    Args:
+        product_id (int): The ID of the product.
+    Returns:
+        Response: JSON response containing the product.
+    """
+
+    item = db_instance.get_items_by_id(product_id)
+    if not item:
+        return jsonify({"error": "Item not found"}), 404
+    product = serialize_item(item)
+    return jsonify(embed_sellers([product])[0] if wants_sellers() else product)
+
+@app.route("/api/products/<int:product_id>/similar", methods=["GET"])
+def get_similar_products(product_id):
+    # docstring
+    """
+    Get the products most similar to a product, most similar first.
+    Query parameters: optional `limit`; `embed=seller` adds the seller summaries.
+    Args:
+        product_id (int): The ID of the product.
+    Returns:
+        Response: JSON response containing the list of similar products.
+    """
+
+    try:
+        items = db_instance.get_similar_items(
+            product_id,
+            limit=request.args.get("limit", similar.DEFAULT_LIMIT, type=int),
+            as_documents=True,
+        )
+    except similar.IndexNotReady:
+        response = jsonify({"error": "Recommendations are warming up, try again shortly"})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(similar.WARMUP_RETRY_SECONDS)
+        return response
+    if items is None:
+        return jsonify({"error": "Item not found"}), 404
+    return json_response(product_list_json(items))
+
+@app.route("/api/products/<int:product_id>/view", methods=["POST"])
+def count_product_view(product_id):
+    # docstring
+    """
+    Count a view of a product. The count is written in the next batch (see counters.py).
+    Args:
+        product_id (int): The ID of the product.
+    Returns:
+        Response: 202 once the view is counted.
+    """
+
+    if not db_instance.get_items_by_id(product_id):
+        return jsonify({"error": "Item not found"}), 404
+    counters.count_view(product_id)
+    return jsonify({"counted": True}), 202
+
+@app.route("/api/products/<int:product_id>/order", methods=["POST"])
+def count_product_order(product_id):
+    # docstring
+    """
+    Count an order of a product by the signed-in user. The count is written
+    in the next batch (see counters.py).
+    Args:
+        product_id (int): The ID of the product.
+    Returns:
+        Response: 202 once the order is counted.
+    """
+
+    token = request.cookies.get("jwt_token")
+    if not validate_session(token):
+        return jsonify({"error": "Not logged in or invalid token"}), 401
+    if not db_instance.get_items_by_id(product_id):
+        return jsonify({"error": "Item not found"}), 404
+    counters.count_order(product_id)
+    return jsonify({"counted": True}), 202
+
+@app.route("/api/search", methods=["GET"])
+def search_products():
+    # docstring
+    """
+    Full-text search over product listings, best match first.
+    Query parameters: `q` (search text), optional `category` and `limit`.
+    Returns:
+        Response: JSON response containing the list of matching products.
+    """
+
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"error": "Search query is required"}), 400
+
+    items = db_instance.search_items(
+        query,
+        category=request.args.get("category"),
+        limit=request.args.get("limit", DEFAULT_PAGE_SIZE, type=int),
+        as_documents=True,
+    )
+    return json_response(product_list_json(items))
 
 @app.route("/api/user", methods=["GET"])
 def get_user():
@@ -244,7 +736,15 @@ def get_user():
 
     try:
         data = jwt.decode(token, app.secret_key, algorithms=["HS256"])
-        user = db_instance.get_user_by_sub(data["sub"])
+        # The token carries the user ID, so revalidation needs no user lookup
+        scope = versions.user_scope(data.get("id"))
+        stamps = db_instance.get_versions([scope])
+        etag, last_modified = version_stamp([scope], stamps)
+        if is_not_modified(etag, last_modified):
+            return not_modified_response(etag, last_modified, private=True)
+
+        # A snapshot cached before another process's update is not served under the new ETag
+        user = db_instance.get_cached_user(data["sub"], version=stamps[scope][0])
         if user:
             user_data = {
                 "id": user.id,
@@ -255,7 +755,7 @@ def get_user():
                 "profile_picture": user.profile_picture,
                 "is_admin": user.is_admin,
             }
-            return jsonify(user_data)
+            return with_validators(jsonify(user_data), etag, last_modified, private=True)
         else:
             return jsonify({"error": "User not found"}), 404
     except jwt.ExpiredSignatureError:
@@ -293,11 +793,8 @@ def user_search(user_id):
                 "is_admin": seller.is_admin,
             }
             if user.id != seller.id:
-                send_email(
-                    seller.email,
-                    f"{seller.name} : Listing Search",
-                    f"User {user.name} has searched for your listing. \nThank you for using SpartanSwap!",
-                )
+                # Reported to the seller in the next digest email
+                notifications.record_view(db_instance.engine, seller.id, user.id)
             return jsonify(user_data)
         else:
             return jsonify({"error": "User not found"}), 404
@@ -322,24 +819,24 @@ def update_user():
         return jsonify({"error": "Not logged in or invalid token"}), 401
 
     profile_data = request.json
-    print(profile_data)
+    # Field names only; the values are personal data
+    logger.debug("Profile update", extra={"user_id": user.id, "fields": sorted(profile_data)})
     try:
-        # Update fields directly without app context wrapper
-        user.name = profile_data.get("name", user.name)
-        user.gender = profile_data.get("gender", user.gender)
-        user.phone_number = profile_data.get("phoneNumber", user.phone_number)  # Note: phoneNumber vs phone_number
-
-        user.profile_picture = profile_data.get("profile_picture", user.profile_picture)
+        # validate_session returns a read-only snapshot, so update through DBClass
+        db_instance.update_user(
+            user.sub,
+            name=profile_data.get("name"),
+            gender=profile_data.get("gender"),
+            phone_number=profile_data.get("phoneNumber"),  # Note: phoneNumber vs phone_number
+            profile_picture=profile_data.get("profile_picture"),
+        )
+        # Make sure the next validate_session sees the new profile
+        user_cache.invalidate(user.sub)
 
-        # Explicitly add to session and commit
-        db_instance.db.session.add(user)
-        db_instance.db.session.commit()
-        
         return jsonify({"message": "User updated successfully"}), 200
         
-    except Exception as e:
-        db_instance.db.session.rollback()
-        print(f"Error updating user: {str(e)}")
+    except Exception:
+        logger.exception("Updating user failed", extra={"user_id": user.id})
         return jsonify({"error": "Database update failed"}), 500
     
 @app.route("/api/add_listing", methods=["PUT"])
@@ -376,11 +873,92 @@ def add_listing():
         
         return jsonify({"message": "Listing added successfully"}), 200
         
-    except Exception as e:
-        db_instance.db.session.rollback()
-        print(f"Error adding item: {str(e)}")
+    except Exception:
+        logger.exception("Adding item failed", extra={"user_id": user.id})
         return jsonify({"error": "Database update failed"}), 500
     
+def _bulk_format(default):
+    """Pick ndjson or csv from the `format` parameter or the Content-Type."""
+    requested = request.args.get("format")
+    if requested:
+        return requested.lower()
+    if request.mimetype in ("text/csv", "application/csv"):
+        return "csv"
+    if request.mimetype in ("application/x-ndjson", "application/ndjson", "application/jsonl"):
+        return "ndjson"
+    return default
+
+@app.route("/api/listings/bulk", methods=["POST"])
+def bulk_add_listings():
+    # docstring
+    """
+    Import many listings from an NDJSON or CSV request body, streamed row by row.
+    Rows use the Item column names (see bulk_io.EXPORT_COLUMNS; id, date and
+    views are ignored). Admins may set seller_id; other users always import as
+    themselves.
+    Returns:
+        Response: JSON response with the number of imported rows and the
+        rows that were rejected.
+    """
+
+    token = request.cookies.get("jwt_token")
+    user = validate_session(token)
+    if not user:
+        return jsonify({"error": "Not logged in or invalid token"}), 401
+
+    fmt = _bulk_format("ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    request.max_content_length = bulk_io.MAX_IMPORT_BYTES
+    lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+    rows = bulk_io.read_csv(lines) if fmt == "csv" else bulk_io.read_ndjson(lines)
+
+    def owned(rows):
+        """Default the seller to the importing user, and force it for non-admins."""
+        for row in rows:
+            if isinstance(row, dict) and (not user.is_admin or not row.get("seller_id")):
+                row["seller_id"] = user.id
+            yield row
+
+    try:
+        result = db_instance.bulk_add_items(owned(rows))
+    except (UnicodeDecodeError, bulk_io.csv.Error) as e:
+        return jsonify({"error": f"Could not parse the upload: {e}"}), 400
+    except Exception:
+        logger.exception("Importing items failed", extra={"user_id": user.id})
+        return jsonify({"error": "Database update failed"}), 500
+    return jsonify(result), 200
+
+@app.route("/api/listings/export", methods=["GET"])
+def export_listings():
+    # docstring
+    """
+    Stream listings as NDJSON (default) or CSV. Admins export the whole
+    catalog, or one seller with `sellerId`; other users export their own.
+    Returns:
+        Response: Streamed file of listings in the bulk import format.
+    """
+
+    token = request.cookies.get("jwt_token")
+    user = validate_session(token)
+    if not user:
+        return jsonify({"error": "Not logged in or invalid token"}), 401
+
+    fmt = _bulk_format("ndjson")
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": "format must be ndjson or csv"}), 400
+    seller_id = request.args.get("sellerId", type=int) if user.is_admin else user.id
+    rows = (row._mapping for row in db_instance.iter_item_rows(seller_id=seller_id))
+    if fmt == "csv":
+        body, mimetype = bulk_io.write_csv(rows), "text/csv"
+    else:
+        body, mimetype = bulk_io.write_ndjson(rows), "application/x-ndjson"
+    return Response(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=listings.{fmt}"},
+    )
+
 @app.route("/api/delete_listing", methods=["DELETE"])
 def delete_listing():
     # docstring
@@ -416,59 +994,68 @@ def delete_listing():
     except Exception as e:
         return jsonify({"error": "Database update failed"}), 500
 
-@app.route("/api/upload-profile-photo", methods=["POST"])
-def upload_profile_photo():
-    # docstring
+def upload_image():
     """
-    Upload a profile photo to imgbb and return the URL.
+    Store the image sent in the "image" form field with the configured backend.
+    Storing on this server's disk requires a signed-in user.
     Returns:
-        Response: JSON response containing the URL of the uploaded image.
+        Response: JSON response containing the URLs of the image and its thumbnail.
     """
 
+    if isinstance(image_store, LocalImageStorage) and not validate_session(request.cookies.get("jwt_token")):
+        return jsonify({"error": "Not logged in or invalid token"}), 401
     file = request.files.get("image")
     if not file:
         return jsonify({"error": "No file provided"}), 400
 
-    imgbb_api_key = "aaeb2e69efbfbf1b37e059229378b797"
-    url = "https://api.imgbb.com/1/upload"
-    payload = {
-        "key": imgbb_api_key,
-        "image": base64.b64encode(file.read()),
-    }
+    try:
+        stored = image_store.save(file)
+    except UploadError as e:
+        return jsonify({"error": str(e)}), e.status
+    return jsonify({"url": stored.url, "thumbnailUrl": stored.thumbnail_url})
 
-    response = requests.post(url, data=payload)
-    if response.status_code == 200:
-        data = response.json()
-        return jsonify({"url": data["data"]["url"]})
-    else:
-        return jsonify({"error": "Failed to upload to imgbb"}), 500
+@app.route("/api/upload-profile-photo", methods=["POST"])
+def upload_profile_photo():
+    # docstring
+    """
+    Upload a profile photo and return the URL.
+    Returns:
+        Response: JSON response containing the URL of the uploaded image.
+    """
+
+    return upload_image()
     
 @app.route("/api/upload-listing-photo", methods=["POST"])
 def upload_listing_photo():
     # docstring
     """
-    Upload a listing photo to imgbb and return the URL.
+    Upload a listing photo and return the URL.
     Returns:
         Response: JSON response containing the URL of the uploaded image.
     """
 
-    file = request.files.get("image")
-    if not file:
-        return jsonify({"error": "No file provided"}), 400
+    return upload_image()
 
-    imgbb_api_key = "aaeb2e69efbfbf1b37e059229378b797"
-    url = "https://api.imgbb.com/1/upload"
-    payload = {
-        "key": imgbb_api_key,
-        "image": base64.b64encode(file.read()),
-    }
+@app.route("/images/<name>", methods=["GET"])
+def serve_image(name):
+    # docstring
+    """
+    Serve an image from the local image store.
+    Args:
+        name (str): The stored file name.
+    Returns:
+        Response: The image file.
+    """
 
-    response = requests.post(url, data=payload)
-    if response.status_code == 200:
-        data = response.json()
-        return jsonify({"url": data["data"]["url"]})
-    else:
-        return jsonify({"error": "Failed to upload to imgbb"}), 500
+    if not isinstance(image_store, LocalImageStorage):
+        abort(404)
+    stored_name = image_store.resolve(name)
+    if stored_name is None:
+        abort(404)
+    # Names are content hashes, so the files never change; an original served
+    # in place of a variant that is still rendering must not be cached though
+    max_age = 31536000 if stored_name == name else 0
+    return send_from_directory(image_store.directory, stored_name, max_age=max_age)
     
 @app.route("/api/products/<int:product_id>", methods=["PUT"])
 def update_product(product_id):
@@ -498,13 +1085,19 @@ def update_product(product_id):
         db_instance.update_item(product_id, data)
         return jsonify({"message": "Listing updated"}), 200
     except Exception as e:
-        print("exception:", e)
+        logger.exception("Updating item failed", extra={"item_id": product_id})
         return jsonify({"error": str(e)}), 500
 
 # Crear las tablas en la base de datos con manejo de errores
 # Making the datatables with error handling
 if __name__ == "__main__":
+    # Report N+1 query patterns while developing
+    query_detector.configure(os.environ.get("QUERY_DETECTOR", query_detector.LOG))
+    # With debug on, the reloader runs this file in a watcher process and again
+    # in the child that serves; only the serving child starts the services
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
     try:
         app.run(port=5001, debug=True)
-    except Exception as e:
-        print(f"Error al crear la base de datos: {e}")
+    except Exception:
+        logger.exception("Error al crear la base de datos")
@@ -0,0 +1,102 @@
+"""
+Benchmark of the per-request overhead of DBClass.
+
+Simulates the work of a product page request (the product, its seller and
+a page of the seller's other listings) against a throwaway SQLite database,
+once the way DBClass used to do it (an app context and ORM entities per
+call) and once through the request's unit of work with ItemRecords.
+
+Usage: python bench_db_class.py [requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from flask import Flask
+
+# Never touch the real database
+_directory = tempfile.mkdtemp(prefix="spartanswap-bench-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_directory, "bench.db")
+
+import db_config
+from db_class import DBClass, Item, User
+
+SELLERS = 50
+ITEMS_PER_SELLER = 40
+PAGE_SIZE = 24
+
+
+def setup():
+    """Create a DBClass on a fresh database filled with sample listings."""
+    app = Flask(__name__)
+    db_config.configure_app(app)
+    instance = DBClass(app)
+    instance.create_tables()
+    for seller in range(SELLERS):
+        instance.add_user(sub=f"bench-{seller}", email=f"bench{seller}@case.edu", name=f"Seller {seller}")
+    instance.bulk_add_items(
+        {
+            "seller_id": seller + 1,
+            "item_type": "Book",
+            "category": "Books",
+            "color": "Blue",
+            "price": 10 + number,
+            "condition": "Used",
+            "name": f"Book {seller}-{number}",
+            "description": "A sample listing",
+        }
+        for seller in range(SELLERS)
+        for number in range(ITEMS_PER_SELLER)
+    )
+    return instance
+
+
+def legacy_request(instance, item_id):
+    """One request as it used to run: a context push and ORM entities per call."""
+    with instance.app.app_context():
+        item = Item.query.filter_by(id=item_id).first()
+    with instance.app.app_context():
+        seller = User.query.filter_by(id=item.seller_id).first()
+    with instance.app.app_context():
+        others = Item.query.filter_by(seller_id=seller.id).order_by(Item.date.desc()).limit(PAGE_SIZE).all()
+    return [(other.id, other.name, other.price) for other in others], seller.name
+
+
+def unit_of_work_request(instance, item_id):
+    """The same request inside one app context, reading ItemRecords and UserSnapshots."""
+    with instance.app.app_context():
+        item = instance.get_items_by_id(item_id)
+        seller = instance.get_user_by_id(item.seller_id)
+        others, _ = instance.get_items_page(seller_id=seller.id, limit=PAGE_SIZE)
+    return [(other.id, other.name, other.price) for other in others], seller.name
+
+
+def measure(function, instance, requests):
+    """Return the mean seconds per request of function."""
+    total_items = SELLERS * ITEMS_PER_SELLER
+    # Warm up the connection pool and statement caches
+    for item_id in range(1, 51):
+        function(instance, item_id)
+    start = time.perf_counter()
+    for number in range(requests):
+        function(instance, number % total_items + 1)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    """Run both variants and print the per-request times."""
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    instance = setup()
+    assert legacy_request(instance, 1) == unit_of_work_request(instance, 1)
+
+    legacy = measure(legacy_request, instance, requests)
+    current = measure(unit_of_work_request, instance, requests)
+    print(f"{requests} requests")
+    print(f"context per call, ORM entities:  {legacy * 1e6:8.1f} us/request")
+    print(f"unit of work, records:           {current * 1e6:8.1f} us/request")
+    print(f"overhead reduction:              {(1 - current / legacy) * 100:8.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Streaming NDJSON/CSV/JSON readers and writers for bulk listing import and export."""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+# Bytes of output gathered before a streamed chunk is handed to the server
+FLUSH_BYTES = 65536
+
+# Largest import request body accepted
+MAX_IMPORT_BYTES = 256 * 1024 * 1024
+
+# Columns exchanged in bulk files, in export order
+EXPORT_COLUMNS = (
+    "id", "date", "seller_id", "item_type", "category", "color", "price",
+    "condition", "name", "image_url", "orders", "views", "description", "is_custom",
+)
+
+
+def read_ndjson(lines):
+    """
+    Yield one row per non-blank line of NDJSON.
+    Malformed lines yield None so the importer can report them by position.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def read_csv(lines):
+    """Yield one dict per CSV record, keyed by the header row."""
+    yield from csv.DictReader(lines)
+
+
+def _jsonable(value):
+    """Convert column values json.dumps cannot handle."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def write_ndjson(rows):
+    """Yield an NDJSON line per row mapping."""
+    for row in rows:
+        yield json.dumps({column: _jsonable(row[column]) for column in EXPORT_COLUMNS}) + "\n"
+
+
+def write_csv(rows):
+    """Yield the CSV header and then one CSV line per row mapping."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow([_jsonable(row[column]) for column in EXPORT_COLUMNS])
+        # Flush regularly so the response streams without buffering everything
+        if buffer.tell() > FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_json_array(objects):
+    """Yield a JSON array of the objects in chunks, never holding the whole document."""
+    parts = ["["]
+    size = 1
+    separator = ""
+    for obj in objects:
+        part = separator + json.dumps(obj, separators=(",", ":"))
+        parts.append(part)
+        size += len(part)
+        separator = ","
+        if size > FLUSH_BYTES:
+            yield "".join(parts)
+            parts = []
+            size = 0
+    parts.append("]")
+    yield "".join(parts)
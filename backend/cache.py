@@ -0,0 +1,220 @@
+"""In-process TTL/LRU caches for product listing responses and signed-in users."""
+
+import threading
+from collections import namedtuple
+from cachetools import TTLCache
+from sqlalchemy import inspect
+from sqlalchemy.orm import object_session
+
+# Total size of the listing payloads kept, and how long each stays fresh;
+# bounded in bytes because the filters in a cache key are chosen by the client,
+# and every filter combination of the full list would be a whole catalog
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_TTL_SECONDS = 60
+
+# Bytes counted for each cached product besides its JSON, and for each entry
+ENTRY_OVERHEAD_BYTES = 256
+PRODUCT_OVERHEAD_BYTES = 100
+
+# Number of signed-in users kept, and how long a profile may be served stale
+# by a worker that did not handle the update itself
+USER_CACHE_MAXSIZE = 4096
+USER_CACHE_TTL_SECONDS = 30
+
+# Key in Session.info collecting the (category, seller) scopes touched by a transaction
+_PENDING_SCOPES = "product_cache_scopes"
+
+
+def payload_size(entry):
+    """Approximate bytes held by a cached listing: its product documents (ProductDocuments) and some overhead."""
+    _, payload = entry
+    # Pages are cached as (documents, next cursor), full lists as the documents
+    documents = payload[0] if isinstance(payload, tuple) else payload
+    return ENTRY_OVERHEAD_BYTES + sum(len(document.body) + PRODUCT_OVERHEAD_BYTES for document in documents)
+
+
+class ProductCache:
+    """
+    Cache of listing payloads keyed by normalized query parameters, bounded
+    by the total size of the payloads (least recently used evicted first).
+    Every entry records the category and seller it was filtered by (None
+    meaning "any"), so a committed item change only evicts the entries that
+    could contain that item.
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL_SECONDS):
+        """Create an empty cache holding at most max_bytes of payloads for ttl seconds."""
+        self._entries = TTLCache(maxsize=max_bytes, ttl=ttl, getsizeof=payload_size)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached payload for key, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, payload, category=None, seller_id=None):
+        """
+        Cache payload under key, scoped to the category and seller it was filtered by.
+        A payload larger than the whole cache is not cached.
+        """
+        scope = (category or None, str(seller_id) if seller_id else None)
+        with self._lock:
+            try:
+                self._entries[key] = (scope, payload)
+            except ValueError:
+                self._entries.pop(key, None)
+
+    def invalidate(self, category, seller_id):
+        """Evict every entry that could include an item in this category from this seller."""
+        seller_id = str(seller_id)
+        with self._lock:
+            stale = [
+                key
+                for key, ((entry_category, entry_seller), _) in list(self._entries.items())
+                if entry_category in (None, category) and entry_seller in (None, seller_id)
+            ]
+            for key in stale:
+                self._entries.pop(key, None)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        """Evict every entry."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "size": len(self._entries),
+                "bytes": self._entries.currsize,
+                "maxBytes": self._entries.maxsize,
+                "ttl": self._entries.ttl,
+            }
+
+
+# Read-only copy of a User row, safe to share between requests and threads
+UserSnapshot = namedtuple(
+    "UserSnapshot",
+    ["id", "sub", "email", "name", "gender", "phone_number", "profile_picture", "is_admin"],
+)
+
+
+def snapshot_user(user):
+    """Copy the columns of a User into a UserSnapshot."""
+    return UserSnapshot(
+        id=user.id,
+        sub=user.sub,
+        email=user.email,
+        name=user.name,
+        gender=user.gender,
+        phone_number=user.phone_number,
+        profile_picture=user.profile_picture,
+        is_admin=user.is_admin,
+    )
+
+
+class UserCache:
+    """
+    Per-process cache of UserSnapshots keyed by Google sub ID.
+    Each snapshot can carry the user's modification counter (see versions.py)
+    from when it was loaded, so callers holding the current counter can
+    reject a snapshot that another process's update made stale.
+    """
+
+    def __init__(self, maxsize=USER_CACHE_MAXSIZE, ttl=USER_CACHE_TTL_SECONDS):
+        """Create an empty cache holding at most maxsize users for ttl seconds."""
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sub, version=None):
+        """
+        Return the cached snapshot for sub, or None on a miss.
+        With a version, a snapshot cached under another version is a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(sub)
+            if entry is None or (version is not None and entry[0] != version):
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user, version=None):
+        """Cache a snapshot under its sub, with the version it was loaded at if known."""
+        with self._lock:
+            self._entries[user.sub] = (version, user)
+
+    def invalidate(self, sub):
+        """Drop the cached snapshot for sub, if any."""
+        with self._lock:
+            self._entries.pop(sub, None)
+
+    def stats(self):
+        """Return the hit/miss counters and current size."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self._entries.maxsize,
+                "ttl": self._entries.ttl,
+            }
+
+
+# Shared cache for the product listing endpoint
+product_cache = ProductCache()
+
+# Shared cache for session validation
+user_cache = UserCache()
+
+
+def on_item_change(mapper, connection, target):
+    """Mapper hook remembering which scopes an item change affects until commit."""
+    session = object_session(target)
+    if session is None:
+        return
+    scopes = session.info.setdefault(_PENDING_SCOPES, set())
+    state = inspect(target)
+    old_category = state.attrs.category.history.deleted
+    old_seller = state.attrs.seller_id.history.deleted
+    if old_category or old_seller:
+        # The item moved, so listings of its old category/seller change too
+        scopes.add((
+            old_category[0] if old_category else target.category,
+            old_seller[0] if old_seller else target.seller_id,
+        ))
+    scopes.add((target.category, target.seller_id))
+
+
+def remember_scopes(session, scopes):
+    """Evict the given (category, seller) scopes when the session's transaction commits."""
+    session.info.setdefault(_PENDING_SCOPES, set()).update(scopes)
+
+
+def on_commit(session):
+    """Session hook evicting the cache entries affected by the committed transaction."""
+    for category, seller_id in session.info.pop(_PENDING_SCOPES, ()):
+        product_cache.invalidate(category, seller_id)
+
+
+def on_rollback(session):
+    """Session hook forgetting the scopes of a rolled back transaction."""
+    session.info.pop(_PENDING_SCOPES, None)
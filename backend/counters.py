@@ -0,0 +1,152 @@
+"""
+Write-behind order and view counters for items.
+
+Counting a click only adds to an in-memory buffer. A background thread
+periodically writes every buffered item as one batch of relative
+`UPDATE item SET orders = orders + ?, views = views + ?` statements in a
+single transaction, so the increments are atomic (nothing is read first)
+and SQLite's writer lock is taken once per flush instead of once per click.
+Counts still buffered when a process dies are lost; that is the trade-off
+for the popularity counters, which only need to be approximately right.
+
+A flush re-renders the product documents of the counted items in the same
+transaction, so every listing read from the documents shows the written
+counts, but it only moves the POPULARITY version: the item partitions and
+cached listings are left alone, so counting does not invalidate every
+listing ETag or the similar-items index. A listing served from the cache,
+or revalidated (304) under an unchanged ETag, may still show the counts of
+when it was built; the popularity sorts, whose order depends on the counts,
+are versioned by POPULARITY and always current.
+"""
+
+import atexit
+import logging
+import threading
+from sqlalchemy import text
+import documents
+import versions
+
+# How often buffered counts are written, and how many distinct items may be
+# buffered before a flush is started early
+FLUSH_INTERVAL_SECONDS = 5
+MAX_PENDING_ITEMS = 10000
+
+# orders is nullable in older databases
+INCREMENT_SQL = (
+    "UPDATE item SET orders = COALESCE(orders, 0) + :orders, views = views + :views "
+    "WHERE id = :id"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class CounterBuffer:
+    """Per-process buffer of order and view increments, keyed by item ID."""
+
+    def __init__(self):
+        """Create an empty buffer."""
+        self._lock = threading.Lock()
+        self._pending = {}
+        self.full = threading.Event()
+
+    def add(self, item_id, orders=0, views=0):
+        """Buffer increments for one item."""
+        with self._lock:
+            counts = self._pending.setdefault(item_id, [0, 0])
+            counts[0] += orders
+            counts[1] += views
+            if len(self._pending) >= MAX_PENDING_ITEMS:
+                self.full.set()
+
+    def take(self):
+        """Remove and return every buffered increment."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self.full.clear()
+            return pending
+
+    def restore(self, pending):
+        """Put back increments whose flush failed, to be retried with the next one."""
+        with self._lock:
+            for item_id, (orders, views) in pending.items():
+                counts = self._pending.setdefault(item_id, [0, 0])
+                counts[0] += orders
+                counts[1] += views
+
+
+# Shared per-process buffer
+buffer = CounterBuffer()
+
+
+def count_order(item_id):
+    """Count one order of an item, written at the next flush."""
+    buffer.add(item_id, orders=1)
+
+
+def count_view(item_id):
+    """Count one view of an item, written at the next flush."""
+    buffer.add(item_id, views=1)
+
+
+def flush(engine):
+    """
+    Write the buffered increments and the touched items' documents in one
+    transaction, bumping POPULARITY.
+    Returns:
+        int: The number of items updated.
+    """
+    pending = buffer.take()
+    if not pending:
+        return 0
+    parameters = [
+        {"id": item_id, "orders": orders, "views": views}
+        for item_id, (orders, views) in sorted(pending.items())
+    ]
+    try:
+        with engine.begin() as connection:
+            connection.execute(text(INCREMENT_SQL), parameters)
+            documents.refresh(connection, [params["id"] for params in parameters])
+            versions.bump(connection, [versions.POPULARITY])
+    except Exception:
+        buffer.restore(pending)
+        raise
+    return len(parameters)
+
+
+class FlushWorker(threading.Thread):
+    """Background thread flushing the counters every FLUSH_INTERVAL_SECONDS, or sooner when the buffer fills."""
+
+    def __init__(self, engine, interval=FLUSH_INTERVAL_SECONDS):
+        """Create a worker flushing to the given engine's database."""
+        super().__init__(name="item-counter-flush", daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Flush until stopped, then flush once more."""
+        while not self.stopping.is_set():
+            buffer.full.wait(self.interval)
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        """Flush, logging failures; failed increments stay buffered."""
+        try:
+            flush(self.engine)
+        except Exception:
+            logger.warning("Flushing item counters failed", exc_info=True)
+
+    def stop(self, timeout=None):
+        """Stop the worker after a final flush."""
+        self.stopping.set()
+        buffer.full.set()
+        self.join(timeout)
+
+
+def configure(engine, interval=FLUSH_INTERVAL_SECONDS):
+    """Start flushing counters in the background, and once more when the process exits."""
+    worker = FlushWorker(engine, interval)
+    worker.start()
+    atexit.register(worker.stop, 10)
+    return worker
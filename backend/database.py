@@ -1,4 +0,0 @@
-from db_class import DBClass
-
-# Create a database instance
-db = DBClass.create_new()
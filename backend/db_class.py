@@ -6,38 +6,278 @@
 
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime, timezone
-from sqlalchemy import CheckConstraint
-from flask import Flask
+from sqlalchemy import CheckConstraint, event, insert, inspect, select, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from flask import Flask, current_app, has_app_context
+from collections import namedtuple
+from contextlib import contextmanager
+import base64
+import json
+import logging
+import cache
+import db_config
+import documents
+import facets
+import search
+import similar
+import versions
+
+logger = logging.getLogger(__name__)
+
+# Page size limits for the paginated product listing
+DEFAULT_PAGE_SIZE = 24
+MAX_PAGE_SIZE = 100
+
+# Item columns only counters.py writes, as batched increments; updates never set them
+COUNTER_COLUMNS = frozenset(("orders", "views"))
+
+# Supported sort orders for item listings
+SORT_ORDERS = ("newest", "price_asc", "price_desc", "popular", "most_viewed")
+
+# Type of the sort value in a cursor for each sort order (dates as ISO strings)
+CURSOR_VALUE_TYPES = {
+    "newest": (str,),
+    "price_asc": (int, float),
+    "price_desc": (int, float),
+    "popular": (int,),
+    "most_viewed": (int,),
+}
+
+# Rows inserted per transaction by bulk_add_items, and fetched per batch by iter_item_rows
+BULK_CHUNK_SIZE = 500
+EXPORT_BATCH_SIZE = 1000
+
+# Item columns accepted by bulk_add_items and whether each is required
+BULK_COLUMNS = {
+    "seller_id": True,
+    "item_type": True,
+    "category": True,
+    "color": False,
+    "price": True,
+    "condition": True,
+    "name": True,
+    "image_url": False,
+    "orders": False,
+    "description": False,
+    "is_custom": False,
+}
+
+# Read-only copy of an Item row returned by DBClass, safe to use after the
+# session that loaded it is gone
+ItemRecord = namedtuple(
+    "ItemRecord",
+    ["id", "date", "seller_id", "item_type", "category", "color", "price",
+     "condition", "image_url", "name", "orders", "views", "description", "is_custom"],
+)
+
+# Public part of a seller's profile, embedded next to their listings
+SellerSummary = namedtuple("SellerSummary", ["id", "name", "profile_picture"])
+
+
+# An item's precomputed product JSON (see documents.py), with the seller ID
+# needed to embed seller summaries
+ProductDocument = namedtuple("ProductDocument", ["id", "seller_id", "body"])
+
+
+def record_item(item):
+    """Copy the columns of an Item into an ItemRecord."""
+    return ItemRecord._make(getattr(item, field) for field in ItemRecord._fields)
+
+
+def normalize_item_row(row):
+    """
+    Validate one bulk import row and convert it to Item column values.
+    CSV rows arrive as strings, so numbers and booleans are parsed here.
+    Args:
+        row (dict): Column name -> value.
+    Returns:
+        dict: Values for every column in BULK_COLUMNS.
+    Raises:
+        ValueError: If the row is not an object, misses a required column or has a bad value.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Row is not an object")
+    values = {}
+    for column, required in BULK_COLUMNS.items():
+        value = row.get(column)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in (None, ""):
+            if required:
+                raise ValueError(f"Missing {column}")
+            value = None
+        values[column] = value
+    try:
+        values["seller_id"] = int(values["seller_id"])
+        values["price"] = float(values["price"])
+        values["orders"] = int(values["orders"]) if values["orders"] is not None else 0
+    except (TypeError, ValueError):
+        raise ValueError("seller_id, price and orders must be numbers")
+    if values["price"] <= 0:
+        raise ValueError("price must be positive")
+    is_custom = values["is_custom"]
+    if isinstance(is_custom, str):
+        if is_custom.lower() not in ("true", "false", "1", "0", "yes", "no"):
+            raise ValueError("is_custom must be true or false")
+        is_custom = is_custom.lower() in ("true", "1", "yes")
+    values["is_custom"] = bool(is_custom)
+    return values
+
+
+def encode_cursor(values):
+    """Encode the keyset values of the last row of a page as an opaque cursor."""
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _is_a(value, types):
+    """isinstance, except that booleans are not taken for numbers."""
+    return isinstance(value, types) and not isinstance(value, bool)
+
+
+def decode_cursor(cursor, sort):
+    """
+    Decode a cursor produced by encode_cursor for the given sort order.
+    Raises:
+        ValueError: If the cursor is malformed or its values do not fit the sort order.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != 2:
+        raise ValueError("Invalid cursor")
+    last_value, last_id = values
+    if not _is_a(last_value, CURSOR_VALUE_TYPES[sort]) or not _is_a(last_id, int):
+        raise ValueError("Invalid cursor")
+    return values
 
 
 class DBClass:
-    """Class to handle all database operations using SQLAlchemy."""
+    """
+    Class to handle all database operations using SQLAlchemy.
+    Reads return immutable ItemRecord / UserSnapshot tuples rather than live
+    ORM entities, so callers never trigger lazy reloads on detached objects.
+    Every method runs in the current unit of work: inside a request it uses
+    the request-scoped session, elsewhere it pushes an app context of its own.
+    """
     db = SQLAlchemy()
 
     def __init__(self, app):
         """Initialize the database with the given Flask app."""
         self.app = app
         self.db.init_app(app)
+        with app.app_context():
+            self.engine = self.db.engine
 
     @classmethod
     def create_new(cls):
         """Create a new instance of the database."""
         app = Flask(__name__)
-        app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///spartanswap.db"
-        app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+        db_config.configure_app(app)
 
         instance = cls(app)
 
         with app.app_context():
-            instance.db.create_all()
-            print("Database successfully created.")
+            instance.create_tables()
+            logger.info("Database successfully created.")
 
         return instance
-        
+
+    @contextmanager
+    def session_scope(self):
+        """
+        Yield the session of the current unit of work.
+        The session of an active context of this app (a request, a CLI
+        command) is reused, so several calls share one session and one
+        context push; otherwise a context is pushed for the duration.
+        """
+        if has_app_context() and current_app._get_current_object() is self.app:
+            yield self.db.session
+        else:
+            with self.app.app_context():
+                yield self.db.session
+
+    @contextmanager
+    def unit_of_work(self):
+        """Yield the session, committing when the block succeeds and rolling back if it raises."""
+        with self.session_scope() as session:
+            try:
+                yield session
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+
+    @staticmethod
+    def _select_items():
+        """Select the Item columns in ItemRecord order."""
+        return select(*(Item.__table__.c[field] for field in ItemRecord._fields))
+
+    @staticmethod
+    def _select_users():
+        """Select the User columns in UserSnapshot order."""
+        return select(*(User.__table__.c[field] for field in cache.UserSnapshot._fields))
+
+    @staticmethod
+    def _select_documents():
+        """Select item IDs, seller IDs and documents, as ProductDocument fields."""
+        return (
+            select(Item.id, Item.seller_id, ItemDocument.body)
+            .select_from(Item)
+            .outerjoin(ItemDocument, ItemDocument.item_id == Item.id)
+        )
+
+    def _documents_from_rows(self, rows):
+        """Turn (id, seller_id, body) rows into ProductDocuments, rendering any document not written yet."""
+        missing = [row[0] for row in rows if row[2] is None]
+        if not missing:
+            return list(map(ProductDocument._make, rows))
+        rendered = {item.id: documents.render(item) for item in self.get_items_by_ids(missing)}
+        return [
+            ProductDocument(item_id, seller_id, body if body is not None else rendered[item_id])
+            for item_id, seller_id, body in rows
+            if body is not None or item_id in rendered
+        ]
+
+    def _fetch_documents(self, query):
+        """Run a document select on the Core connection (no ORM row processing) and return ProductDocuments."""
+        with self.session_scope() as session:
+            rows = session.connection().execute(query).all()
+        return self._documents_from_rows(rows)
+
+    def _fetch_items(self, query):
+        """Run an item select and return its rows as ItemRecords."""
+        with self.session_scope() as session:
+            return [ItemRecord._make(row) for row in session.execute(query)]
+
+    def _fetch_user(self, query):
+        """Run a user select and return the first row as a UserSnapshot, or None."""
+        with self.session_scope() as session:
+            row = session.execute(query.limit(1)).first()
+        return cache.UserSnapshot._make(row) if row is not None else None
+
+    def create_tables(self):
+        """Create all tables and any columns or indexes missing from an existing database."""
+        with self.session_scope():
+            self.db.create_all()
+            # create_all skips tables that already exist, so columns and indexes
+            # added after a table was first created have to be created explicitly
+            existing = {column["name"] for column in inspect(self.engine).get_columns("item")}
+            if "views" not in existing:
+                with self.engine.begin() as connection:
+                    connection.execute(text("ALTER TABLE item ADD COLUMN views INTEGER NOT NULL DEFAULT 0"))
+            for index in Item.__table__.indexes:
+                index.create(bind=self.engine, checkfirst=True)
+            search.create_index(self.engine)
+            facets.sync(self.engine)
+            documents.sync(self.engine)
 
     def add_user(self, sub, email, name, profile_picture=None, gender=None, phone_number=None, is_admin=False):
-        """Add a new user to the database."""
-        with self.app.app_context():
+        """Add a new user to the database and return a snapshot of it."""
+        with self.unit_of_work() as session:
             new_user = User(
                 sub=sub,
                 email=email,
@@ -47,22 +287,66 @@ class DBClass:
                 phone_number=phone_number,
                 is_admin=is_admin
             )
-            self.db.session.add(new_user)
-            self.db.session.commit()
-            print(f"Usuario {name} agregado correctamente.")
+            session.add(new_user)
+            session.flush()
+            user = cache.snapshot_user(new_user)
+        logger.info("User added", extra={"user_id": user.id})
+        return user
         
     def get_user_by_sub(self, sub):
-        """Retrieve a user by their Google sub ID."""
-        with self.app.app_context():
-            user = User.query.filter_by(sub=sub).first()
-            #print(type(user))
-            return user
+        """Retrieve a snapshot of a user by their Google sub ID."""
+        return self._fetch_user(self._select_users().where(User.sub == sub))
     
+    def get_cached_user(self, sub, version=None):
+        """
+        Retrieve a read-only snapshot of a user by their Google sub ID,
+        served from the per-process user cache when possible.
+        Args:
+            sub (str): The user's Google sub ID.
+            version (int): The user's current modification counter, if known;
+                a snapshot cached under another version is reloaded.
+        Returns:
+            UserSnapshot: The user, or None if there is no such user.
+        """
+        user = cache.user_cache.get(sub, version)
+        if user is None:
+            user = self.get_user_by_sub(sub)
+            if user is None:
+                return None
+            cache.user_cache.set(user, version)
+        return user
+
+    def get_or_create_user(self, sub, email, name, profile_picture=None, is_admin=False):
+        """
+        Return the user with this Google sub ID, creating them if needed.
+        A returning user is usually served from the user cache; a new one is
+        created with a single INSERT ... ON CONFLICT DO NOTHING.
+        Returns:
+            tuple: (UserSnapshot, True if the user was just created)
+        """
+        user = self.get_cached_user(sub)
+        if user is not None:
+            return user, False
+
+        values = dict(sub=sub, email=email, name=name, profile_picture=profile_picture, is_admin=is_admin)
+        dialect = postgresql if self.engine.dialect.name == "postgresql" else sqlite
+        statement = dialect.insert(User).values(**values).on_conflict_do_nothing().returning(User.id)
+        with self.unit_of_work() as session:
+            row = session.execute(statement).first()
+        if row is None:
+            # Created concurrently by another request
+            user = self.get_cached_user(sub)
+            if user is None:
+                raise ValueError(f"Email {email} already belongs to another account")
+            return user, False
+
+        user = cache.UserSnapshot(id=row.id, gender=None, phone_number=None, **values)
+        cache.user_cache.set(user)
+        return user, True
+
     def get_user_by_id(self, user_id):
-        """Retrieve a user by their database ID."""
-        with self.app.app_context():
-            user = User.query.filter_by(id=user_id).first()
-            return user
+        """Retrieve a snapshot of a user by their database ID."""
+        return self._fetch_user(self._select_users().where(User.id == user_id))
     
     def add_item(
         self,
@@ -78,8 +362,8 @@ class DBClass:
         description=None,
         is_custom=False,
     ):
-        """Add a new item listing to the database."""
-        with self.app.app_context():
+        """Add a new item listing to the database and return a record of it."""
+        with self.unit_of_work() as session:
             new_item = Item(
                 seller_id=seller_id,
                 item_type=item_type,
@@ -93,46 +377,307 @@ class DBClass:
                 description=description,
                 is_custom=is_custom,
             )
-            self.db.session.add(new_item)
-            self.db.session.commit()
-            print(f"Ítem {name} agregado correctamente.")
+            session.add(new_item)
+            # Flush for the generated ID and date, and copy them before the
+            # commit expires the instance
+            session.flush()
+            item = record_item(new_item)
+        logger.info("Item added", extra={"item_id": item.id, "seller_id": seller_id})
+        return item
             
+    def bulk_add_items(self, rows, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Insert many items with one multi-row INSERT per chunk, each chunk in its own transaction.
+        The search index, facet counts, modification counters and listing
+        cache are updated per chunk, since bulk inserts skip the ORM hooks.
+        Invalid rows are skipped and reported.
+        Args:
+            rows (iterable): Dicts of Item columns (see BULK_COLUMNS); consumed lazily.
+            chunk_size (int): Rows per transaction.
+        Returns:
+            dict: {"inserted": count, "errors": [{"row": position, "error": message}]}
+        """
+        inserted = 0
+        errors = []
+        chunk = []
+        for position, row in enumerate(rows, start=1):
+            try:
+                chunk.append(normalize_item_row(row))
+            except ValueError as e:
+                errors.append({"row": position, "error": str(e)})
+                continue
+            if len(chunk) >= chunk_size:
+                inserted += self._insert_chunk(chunk)
+                chunk = []
+        if chunk:
+            inserted += self._insert_chunk(chunk)
+        return {"inserted": inserted, "errors": errors}
+
+    def _insert_chunk(self, chunk):
+        """Insert one chunk of normalized rows and maintain the derived tables."""
+        now = datetime.now(timezone.utc)
+        for values in chunk:
+            values["date"] = now
+        with self.unit_of_work() as session:
+            ids = session.execute(
+                insert(Item).returning(Item.id, sort_by_parameter_order=True),
+                chunk,
+            ).scalars().all()
+            for values, item_id in zip(chunk, ids):
+                values["id"] = item_id
+            connection = session.connection()
+            if search.is_supported(connection.engine):
+                search.index_items(connection, chunk)
+            facets.count_items(connection, chunk)
+            scopes = {(values["category"], values["seller_id"]) for values in chunk}
+            version_scopes = {versions.ALL_ITEMS}
+            for category, seller_id in scopes:
+                version_scopes.add(versions.category_scope(category))
+                version_scopes.add(versions.seller_scope(seller_id))
+            versions.bump(connection, version_scopes)
+            cache.remember_scopes(session, scopes)
+            similar.remember_items(session, chunk)
+            documents.refresh(connection, ids)
+        return len(chunk)
+
+    def iter_item_rows(self, category=None, seller_id=None, filters=None, columns=None, batch_size=EXPORT_BATCH_SIZE):
+        """
+        Stream item rows without loading ORM entities.
+        Only the requested columns are selected and rows are fetched
+        batch_size at a time, so memory stays flat however large the catalog is.
+        Args:
+            category (str): Optional category filter.
+            seller_id (int): Optional seller filter.
+            filters (dict): Optional facet filters, see _filter_items.
+            columns (list): Item columns to select; all columns by default.
+            batch_size (int): Rows fetched per round-trip.
+        Yields:
+            Row: One item, by ascending ID, with the columns as attributes.
+        """
+        query = select(*(columns or Item.__table__.columns)).select_from(Item).order_by(Item.id)
+        query = self._filter_items(query, category, seller_id, filters)
+        with self.engine.connect() as connection:
+            result = connection.execution_options(yield_per=batch_size).execute(query)
+            yield from result
+
     def delete_item(self, item_id):
         """Delete an item listing from the database."""
-        with self.app.app_context():
-            item = Item.query.get(item_id)
+        with self.unit_of_work() as session:
+            item = session.get(Item, item_id)
             if item:
-                self.db.session.delete(item)
-                self.db.session.commit()
-                print(f"Ítem {item.name} deleted.")
-                return True
-            else:
-                print(f"Ítem {item_id} not in db.")
-                return False
-
-    def get_all_items(self, category=None, seller_id=None):
-        """Retrieve all items, optionally filtered by category or seller."""
-        with self.app.app_context():
-            query = Item.query
-            if category:
-                query = query.filter_by(category=category)
-            if seller_id:
-                query = query.filter_by(seller_id=seller_id)
-            items = query.all()
-            return items
+                session.delete(item)
+        if item:
+            logger.info("Item deleted", extra={"item_id": item_id})
+            return True
+        else:
+            logger.info("Item to delete not found", extra={"item_id": item_id})
+            return False
+
+    @staticmethod
+    def _filter_items(query, category=None, seller_id=None, filters=None):
+        """
+        Apply the listing filters to an Item query or select.
+        Args:
+            query: The Item query or select to filter.
+            category (str): Optional category filter.
+            seller_id (int): Optional seller filter.
+            filters (dict): Optional facet filters: min_price, max_price,
+                conditions, colors, item_types (lists of accepted values) and is_custom.
+        Returns:
+            The filtered query.
+        """
+        if category:
+            query = query.filter(Item.category == category)
+        if seller_id:
+            query = query.filter(Item.seller_id == seller_id)
+        filters = filters or {}
+        if filters.get("min_price") is not None:
+            query = query.filter(Item.price >= filters["min_price"])
+        if filters.get("max_price") is not None:
+            query = query.filter(Item.price <= filters["max_price"])
+        if filters.get("conditions"):
+            query = query.filter(Item.condition.in_(filters["conditions"]))
+        if filters.get("colors"):
+            query = query.filter(Item.color.in_(filters["colors"]))
+        if filters.get("item_types"):
+            query = query.filter(Item.item_type.in_(filters["item_types"]))
+        if filters.get("is_custom") is not None:
+            query = query.filter(Item.is_custom == filters["is_custom"])
+        return query
+
+    def get_all_items(self, category=None, seller_id=None, filters=None, as_documents=False):
+        """
+        Retrieve all items, optionally filtered by category, seller or facet filters.
+        With as_documents=True, ProductDocuments are returned instead of ItemRecords.
+        """
+        if as_documents:
+            return self._fetch_documents(self._filter_items(self._select_documents(), category, seller_id, filters))
+        return self._fetch_items(self._filter_items(self._select_items(), category, seller_id, filters))
+
+    def get_items_page(self, category=None, seller_id=None, sort="newest", limit=DEFAULT_PAGE_SIZE, cursor=None, filters=None, as_documents=False):
+        """
+        Retrieve one page of items using keyset pagination.
+        Args:
+            category (str): Optional category filter.
+            seller_id (int): Optional seller filter.
+            filters (dict): Optional facet filters, see _filter_items.
+            sort (str): One of SORT_ORDERS.
+            limit (int): Maximum number of items to return.
+            cursor (str): Cursor returned with the previous page, if any.
+            as_documents (bool): Return ProductDocuments instead of ItemRecords.
+        Returns:
+            tuple: (list of ItemRecords or ProductDocuments, cursor for the next page or None)
+        """
+        if sort not in SORT_ORDERS:
+            raise ValueError(f"Unknown sort order: {sort}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+        # Keyset column and direction for each sort order; the id breaks ties
+        if sort == "newest":
+            column, descending = Item.date, True
+        elif sort == "price_asc":
+            column, descending = Item.price, False
+        elif sort == "price_desc":
+            column, descending = Item.price, True
+        elif sort == "popular":
+            column, descending = Item.orders, True
+        else:
+            column, descending = Item.views, True
+
+        if as_documents:
+            # The sort column is selected too, to build the next cursor from
+            query = self._select_documents().add_columns(column)
+        else:
+            query = self._select_items()
+        query = self._filter_items(query, category, seller_id, filters)
+
+        if cursor:
+            last_value, last_id = decode_cursor(cursor, sort)
+            if sort == "newest":
+                try:
+                    last_value = datetime.fromisoformat(last_value)
+                except ValueError:
+                    raise ValueError("Invalid cursor")
+            key = tuple_(column, Item.id)
+            query = query.filter(key < (last_value, last_id) if descending else key > (last_value, last_id))
+
+        if descending:
+            query = query.order_by(column.desc(), Item.id.desc())
+        else:
+            query = query.order_by(column.asc(), Item.id.asc())
+
+        # Fetch one extra row to know whether another page exists
+        if as_documents:
+            with self.session_scope() as session:
+                items = session.connection().execute(query.limit(limit + 1)).all()
+        else:
+            items = self._fetch_items(query.limit(limit + 1))
+
+        next_cursor = None
+        if len(items) > limit:
+            items = items[:limit]
+            last = items[-1]
+            last_value = getattr(last, column.key)
+            if sort == "newest":
+                last_value = last_value.isoformat()
+            next_cursor = encode_cursor([last_value, last.id])
+        if as_documents:
+            items = self._documents_from_rows([row[:3] for row in items])
+        return items, next_cursor
         
     def get_items_by_id(self, item_id):
-        """Retrieve an item by its ID."""
-        with self.app.app_context():
-            item = Item.query.filter_by(id=item_id).first()
-            return item
+        """Retrieve a record of an item by its ID, or None."""
+        items = self._fetch_items(self._select_items().where(Item.id == item_id))
+        return items[0] if items else None
+
+    def get_items_by_ids(self, item_ids, as_documents=False):
+        """
+        Retrieve several items in a single query, in the order of the given IDs.
+        With as_documents=True, ProductDocuments are returned instead of ItemRecords.
+        """
+        if not item_ids:
+            return []
+        if as_documents:
+            items = self._fetch_documents(self._select_documents().where(Item.id.in_(item_ids)))
+        else:
+            items = self._fetch_items(self._select_items().where(Item.id.in_(item_ids)))
+        by_id = {item.id: item for item in items}
+        return [by_id[item_id] for item_id in item_ids if item_id in by_id]
     
+    def get_seller_summaries(self, seller_ids):
+        """
+        Retrieve the public profiles of several sellers in a single query.
+        Listings embed their sellers through this rather than one lookup per item.
+        Args:
+            seller_ids (iterable): User IDs; duplicates are fine.
+        Returns:
+            dict: User ID -> SellerSummary, for the IDs that exist.
+        """
+        seller_ids = set(seller_ids)
+        if not seller_ids:
+            return {}
+        query = select(User.id, User.name, User.profile_picture).where(User.id.in_(seller_ids))
+        with self.session_scope() as session:
+            return {row.id: SellerSummary._make(row) for row in session.execute(query)}
+
+    def get_facet_counts(self, category=None):
+        """Read the precomputed facet counts for a category, or the whole catalog."""
+        with self.session_scope() as session:
+            return facets.get_counts(session, category)
+
+    def get_versions(self, scopes):
+        """Read the modification counters of several data partitions, see versions.py."""
+        with self.session_scope() as session:
+            return versions.get_versions(session, scopes)
+
+    def search_items(self, query, category=None, limit=DEFAULT_PAGE_SIZE, as_documents=False):
+        """
+        Full-text search over item names, descriptions, types and colors.
+        Args:
+            query (str): The text typed by the user.
+            category (str): Optional category filter.
+            limit (int): Maximum number of items to return.
+            as_documents (bool): Return ProductDocuments instead of ItemRecords.
+        Returns:
+            list: Matching ItemRecords or ProductDocuments, best match first.
+        """
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        with self.session_scope() as session:
+            item_ids = search.search_item_ids(session, query, category=category, limit=limit)
+        return self.get_items_by_ids(item_ids, as_documents)
+
+    def get_similar_items(self, item_id, limit=similar.DEFAULT_LIMIT, as_documents=False):
+        """
+        Find the items most like a given one, from the in-memory similarity index.
+        Args:
+            item_id (int): The item to find neighbours for.
+            limit (int): Maximum number of items to return.
+            as_documents (bool): Return ProductDocuments instead of ItemRecords.
+        Returns:
+            list: Similar ItemRecords or ProductDocuments, most similar first,
+            or None if the item does not exist.
+        Raises:
+            similar.IndexNotReady: If the index is still being loaded.
+        """
+        limit = max(1, min(int(limit), similar.MAX_LIMIT))
+        similar.index.ensure_fresh(self.engine)
+        similar_ids = similar.index.similar([item_id], limit).get(item_id)
+        if similar_ids is None:
+            # Not indexed here, e.g. created by another process since the last refresh
+            columns = [Item.__table__.c[column] for column in similar.INDEXED_COLUMNS]
+            with self.session_scope() as session:
+                row = session.connection().execute(select(*columns).where(Item.id == item_id)).first()
+            if row is None:
+                return None
+            similar_ids = similar.index.similar_to(similar.item_terms(*row), limit, exclude=item_id)
+        return self.get_items_by_ids(similar_ids, as_documents)
+
     def update_user(self, sub, email=None, name=None, profile_picture=None, gender=None, phone_number=None):
-        """Update a user's information in the database"""
-        with self.app.app_context():
-            user = User.query.filter_by(sub=sub).first()
+        """Update a user's information in the database and return a snapshot of it."""
+        with self.unit_of_work() as session:
+            user = session.execute(select(User).filter_by(sub=sub)).scalar_one_or_none()
             if not user:
-                print(f"User with sub {sub} not found.")
+                logger.warning("User to update not found")
                 return None
 
             # Update provided fields
@@ -147,26 +692,29 @@ class DBClass:
             if phone_number is not None:
                 user.phone_number = phone_number
 
-            self.db.session.commit()
-            print(f"User {user.name} updated successfully.")
-            return user
+            session.flush()
+            snapshot = cache.snapshot_user(user)
+        cache.user_cache.invalidate(sub)
+        logger.info("User updated", extra={"user_id": snapshot.id})
+        return snapshot
         
     def update_item(self, item_id, new_data):
-        """Update an item's information in the database"""
-        with self.app.app_context():
-            item = Item.query.filter_by(id=item_id).first()
+        """Update an item's information in the database and return a record of it."""
+        with self.unit_of_work() as session:
+            item = session.get(Item, item_id)
             if not item:
-                print(f"Item with ID {item_id} not found.")
+                logger.warning("Item to update not found", extra={"item_id": item_id})
                 return None
 
-            # Update provided fields
+            # Update provided fields, except the write-behind counters
             for key, value in new_data.items():
-                if hasattr(item, key):
+                if hasattr(item, key) and key not in COUNTER_COLUMNS:
                     setattr(item, key, value)
 
-            self.db.session.commit()
-            print(f"Item {item.name} updated successfully.")
-            return item
+            session.flush()
+            record = record_item(item)
+        logger.info("Item updated", extra={"item_id": item_id})
+        return record
 
 
 # Database object for app
@@ -202,7 +750,116 @@ class Item(db.Model):
     image_url = db.Column(db.String(255), nullable=True)
     name = db.Column(db.String(255), nullable=False)
     orders = db.Column(db.Integer, default=0)
+    # Written in batches by counters.py, never by read-modify-write
+    views = db.Column(db.Integer, nullable=False, default=0, server_default="0")
     description = db.Column(db.Text, nullable=True)
     is_custom = db.Column(db.Boolean, default=False)
 
-    __table_args__ = (CheckConstraint("price > 0", name="check_price_positive"),)
\ No newline at end of file
+    __table_args__ = (
+        CheckConstraint("price > 0", name="check_price_positive"),
+        # Indexes backing the keyset-paginated listing queries
+        db.Index("ix_item_category_date", "category", "date"),
+        db.Index("ix_item_seller_date", "seller_id", "date"),
+        db.Index("ix_item_price", "price"),
+        db.Index("ix_item_orders", "orders"),
+        db.Index("ix_item_views", "views"),
+    )
+
+
+class ItemFacetCount(db.Model):
+    """Number of items per category having each value of a filterable column."""
+    __tablename__ = "item_facet_count"
+    category = db.Column(db.String(50), primary_key=True)
+    facet = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataVersion(db.Model):
+    """Modification counter of a data partition (all items, a category, a seller or a user)."""
+    __tablename__ = "data_version"
+    scope = db.Column(db.String(150), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    modified_at = db.Column(db.DateTime, nullable=True)
+
+
+class EmailOutbox(db.Model):
+    """Email waiting for, or done with, background delivery (see email_sender.py)."""
+    __tablename__ = "email_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(100), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claimed_by = db.Column(db.String(50), nullable=True)
+    claimed_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+    next_attempt_at = db.Column(db.DateTime, nullable=False)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_email_outbox_status_next_attempt", "status", "next_attempt_at"),
+    )
+
+
+class ItemDocument(db.Model):
+    """Precomputed product JSON of an item, maintained by documents.py."""
+    __tablename__ = "item_document"
+    item_id = db.Column(db.Integer, db.ForeignKey("item.id"), primary_key=True)
+    signature = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+
+
+class ListingView(db.Model):
+    """Lookups of a seller by one viewer since the seller's last digest email."""
+    __tablename__ = "listing_view"
+    seller_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    viewer_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=1)
+    first_viewed_at = db.Column(db.DateTime, nullable=False)
+    last_viewed_at = db.Column(db.DateTime, nullable=False)
+
+
+class SellerDigest(db.Model):
+    """When a seller was last sent a listing view digest, shared by every process sending them."""
+    __tablename__ = "seller_digest"
+    seller_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    last_digest_at = db.Column(db.DateTime, nullable=False)
+
+
+# Keep the full-text index in sync with every flushed item change
+event.listen(Item, "after_insert", search.on_item_insert)
+event.listen(Item, "after_update", search.on_item_update)
+event.listen(Item, "after_delete", search.on_item_delete)
+
+# Keep the facet counts in sync the same way
+event.listen(Item, "after_insert", facets.on_item_insert)
+event.listen(Item, "after_update", facets.on_item_update)
+event.listen(Item, "after_delete", facets.on_item_delete)
+
+# Rewrite the precomputed product documents in the same flush
+event.listen(Item, "after_insert", documents.on_item_change)
+event.listen(Item, "after_update", documents.on_item_change)
+event.listen(Item, "before_delete", documents.on_item_delete)
+
+# Evict cached listings once an item change is committed
+event.listen(Item, "after_insert", cache.on_item_change)
+event.listen(Item, "after_update", cache.on_item_change)
+event.listen(Item, "after_delete", cache.on_item_change)
+event.listen(Session, "after_commit", cache.on_commit)
+event.listen(Session, "after_rollback", cache.on_rollback)
+
+# Apply committed item changes to the similar-items index
+event.listen(Item, "after_insert", similar.on_item_change)
+event.listen(Item, "after_update", similar.on_item_change)
+event.listen(Item, "after_delete", similar.on_item_delete)
+event.listen(Session, "after_commit", similar.on_commit)
+event.listen(Session, "after_rollback", similar.on_rollback)
+
+# Bump the modification counters behind ETag/Last-Modified
+event.listen(Item, "after_insert", versions.on_item_change)
+event.listen(Item, "after_update", versions.on_item_change)
+event.listen(Item, "after_delete", versions.on_item_change)
+event.listen(User, "after_update", versions.on_user_change)
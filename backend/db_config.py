@@ -0,0 +1,81 @@
+"""
+Database engine configuration shared by the API and the standalone DBClass.
+
+DATABASE_URL selects the database (SQLite in the backend directory by
+default). SQLite connections are switched to WAL mode with relaxed fsyncs,
+a busy timeout and memory-mapped reads, so several worker processes can
+read while one writes instead of failing with "database is locked". Server
+databases such as PostgreSQL get a sized QueuePool that checks connections
+before use and recycles them before the server drops them.
+"""
+
+import os
+import sqlite3
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_DATABASE_URL = "sqlite:///spartanswap.db"
+
+# SQLite tuning
+BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+MMAP_SIZE_BYTES = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+# Connection pool for server databases, per worker process
+POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT_SECONDS = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE_SECONDS = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
+
+
+def database_url():
+    """Return the configured database URL."""
+    url = os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URL)
+    # Heroku-style URLs use a scheme SQLAlchemy no longer accepts
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def engine_options(url):
+    """
+    Build the create_engine options for a database URL.
+    Args:
+        url (str): The database URL.
+    Returns:
+        dict: Options for SQLALCHEMY_ENGINE_OPTIONS.
+    """
+    if url.startswith("sqlite"):
+        # The sqlite3 driver waits this long for a lock before raising
+        return {"connect_args": {"timeout": BUSY_TIMEOUT_MS / 1000}}
+    return {
+        "poolclass": QueuePool,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT_SECONDS,
+        "pool_recycle": POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True,
+    }
+
+
+def configure_app(app):
+    """Point a Flask app's SQLAlchemy settings at the configured database."""
+    url = database_url()
+    app.config["SQLALCHEMY_DATABASE_URI"] = url
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(url)
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+
+
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Tune every new SQLite connection for concurrent access."""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    # WAL lets readers run alongside a writer; the mode is stored in the file
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # Safe with WAL: a crash can only lose the last transactions, never corrupt
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={MMAP_SIZE_BYTES}")
+    cursor.close()
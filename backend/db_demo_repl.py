@@ -10,6 +10,7 @@ Options:
     0: Quit
     1: Add Item
     2: See All Items
+    3: Import Items From File (NDJSON or CSV)
 """
 
 from db_class import (
@@ -17,6 +18,7 @@ from db_class import (
     User,
     Item,
 )  # Adjust the module name if your file is named differently
+import bulk_io
 
 
 def main():
@@ -28,6 +30,7 @@ def main():
         print("0: Quit")
         print("1: Add Item")
         print("2: See All Items")
+        print("3: Import Items From File")
         choice = input("Enter your choice: ").strip()
 
         if choice == "0":
@@ -73,6 +76,19 @@ def main():
                     print(
                         f"ID: {item.id} | Type: {item.item_type} | Color: {item.color} | Price: {item.price} | Condition: {item.condition}"
                     )
+        elif choice == "3":
+            print("\n--- Import Items ---")
+            path = input("Enter path to a .ndjson or .csv file: ").strip()
+            try:
+                with open(path, encoding="utf-8", newline="") as f:
+                    rows = bulk_io.read_csv(f) if path.endswith(".csv") else bulk_io.read_ndjson(f)
+                    result = db_instance.bulk_add_items(rows)
+            except OSError as e:
+                print(f"Could not read file: {e}")
+                continue
+            print(f"Imported {result['inserted']} items.")
+            for error in result["errors"]:
+                print(f"Row {error['row']}: {error['error']}")
         else:
             print("Invalid option. Please try again.")
 
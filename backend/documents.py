@@ -0,0 +1,133 @@
+"""
+Precomputed JSON documents of products, the read model behind the listings.
+
+The item_document table holds every item's serialized product JSON, kept
+in sync at write time: the mapper hooks rewrite an item's document in the
+same flush that changes the item, and bulk imports and counter flushes
+refresh the documents of the rows they touched. Listing endpoints select
+the documents and join them into the response text, so a list request
+builds no per-item dicts and serializes no JSON.
+
+Each document records the signature of the settings it was rendered with
+(FORMAT_VERSION and the image storage), so documents rendered under other
+settings are re-rendered by sync() at startup. The image storage settings
+are read from the environment rather than from the app's storage object, so
+every process opening the database (the app, seed.py, the REPL) renders the
+same documents.
+"""
+
+import json
+from sqlalchemy import Boolean, bindparam, text
+from image_storage import local_thumbnail_url, storage_settings
+
+# Bump when serialize() changes, so stored documents are re-rendered
+FORMAT_VERSION = "2"
+
+# Placeholder image for listings without a photo
+DEFAULT_IMAGE = "/essentials.jpg"
+
+# Items re-rendered per statement by refresh() and sync()
+REFRESH_BATCH_SIZE = 500
+
+# Item columns serialize() reads
+COLUMNS = (
+    "id", "seller_id", "name", "price", "orders", "image_url",
+    "item_type", "color", "category", "description", "is_custom",
+)
+
+UPSERT_SQL = (
+    "INSERT INTO item_document (item_id, signature, body) VALUES (:item_id, :signature, :body) "
+    "ON CONFLICT (item_id) DO UPDATE SET signature = excluded.signature, body = excluded.body"
+)
+
+SELECT_ITEMS_SQL = text(
+    f"SELECT {', '.join(COLUMNS)} FROM item WHERE id IN :ids"
+).bindparams(bindparam("ids", expanding=True)).columns(is_custom=Boolean)
+
+def signature():
+    """Identify the settings documents are currently rendered with."""
+    backend, public_url = storage_settings()
+    return f"{FORMAT_VERSION}:{backend}:{public_url or ''}"
+
+
+def serialize(item, public_url=None):
+    """
+    Convert an item into the JSON shape used by the frontend.
+    Args:
+        item: Any object with the Item column attributes, including result rows.
+        public_url (str): Public URL of the local image storage, if selected;
+            read from the environment when not given.
+    Returns:
+        dict: The product data.
+    """
+    if public_url is None:
+        public_url = storage_settings()[1]
+    thumbnail = local_thumbnail_url(public_url, item.image_url) if public_url else None
+    return {
+        "id": item.id,
+        "sellerId": item.seller_id,
+        "name": item.name,
+        "price": item.price,
+        "orders": item.orders,
+        "image": item.image_url if item.image_url else DEFAULT_IMAGE,
+        "thumbnail": thumbnail or item.image_url or DEFAULT_IMAGE,
+        "type": item.item_type,
+        "color": item.color,
+        "category": item.category,
+        "description": item.description,
+        "isCustom": item.is_custom
+    }
+
+
+def render(item, public_url=None):
+    """Serialize an item straight to its JSON document."""
+    return json.dumps(serialize(item, public_url), separators=(",", ":"))
+
+
+def join(bodies):
+    """Join documents into the text of a JSON array."""
+    return "[" + ",".join(bodies) + "]"
+
+
+def _upsert(connection, items):
+    """Write the documents of the given items."""
+    current = signature()
+    public_url = storage_settings()[1]
+    params = [
+        {"item_id": item.id, "signature": current, "body": render(item, public_url)}
+        for item in items
+    ]
+    if params:
+        connection.execute(text(UPSERT_SQL), params)
+
+
+def refresh(connection, item_ids):
+    """Re-render the documents of items changed without the ORM (bulk import, counters)."""
+    item_ids = list(item_ids)
+    for start in range(0, len(item_ids), REFRESH_BATCH_SIZE):
+        batch = item_ids[start:start + REFRESH_BATCH_SIZE]
+        _upsert(connection, connection.execute(SELECT_ITEMS_SQL, {"ids": batch}).all())
+
+
+def sync(engine):
+    """Render the documents that are missing or were rendered with other settings, and drop orphans."""
+    with engine.begin() as connection:
+        stale = connection.execute(text(
+            "SELECT item.id FROM item LEFT JOIN item_document ON item_document.item_id = item.id "
+            "WHERE item_document.signature IS NULL OR item_document.signature != :signature"
+        ), {"signature": signature()}).scalars().all()
+        refresh(connection, stale)
+        connection.execute(text(
+            "DELETE FROM item_document WHERE item_id NOT IN (SELECT id FROM item)"
+        ))
+    return len(stale)
+
+
+def on_item_change(mapper, connection, target):
+    """Mapper hook rewriting an inserted or updated item's document in the same flush."""
+    _upsert(connection, [target])
+
+
+def on_item_delete(mapper, connection, target):
+    """Mapper hook deleting a removed item's document in the same flush, before the item row it references."""
+    connection.execute(text("DELETE FROM item_document WHERE item_id = :item_id"), {"item_id": target.id})
@@ -1,24 +1,330 @@
+"""
+Outbound email for SpartanSwap.
+
+send_email() only records the message in the email_outbox table; a pool of
+background workers delivers it. Each worker keeps one authenticated SMTP
+connection open across messages, claims pending messages in batches, and
+retries failures with exponential backoff.
+
+The SMTP server can be pointed at a local stand-in for testing, e.g.
+`python -m aiosmtpd -n -l localhost:1025` with
+SMTP_HOST=localhost SMTP_PORT=1025 SMTP_STARTTLS=0 SMTP_LOGIN=0.
+"""
+
+import logging
+import os
 import smtplib, ssl
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from sqlalchemy import and_, insert, or_, select, update
 from environment import sender_email, password
+from db_class import EmailOutbox
+import metrics
+
+logger = logging.getLogger(__name__)
+
+outbox = EmailOutbox.__table__
+
+port = int(os.environ.get("SMTP_PORT", 587))
+smtp_server = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+use_starttls = os.environ.get("SMTP_STARTTLS", "1") == "1"
+use_login = os.environ.get("SMTP_LOGIN", "1") == "1"
+
+# Delivery tuning
+WORKER_COUNT = 2
+BATCH_SIZE = 20
+POLL_INTERVAL_SECONDS = 5
+IDLE_DISCONNECT_SECONDS = 60
+SMTP_TIMEOUT_SECONDS = 10
+MAX_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 3600
+STALE_CLAIM_SECONDS = 300
+
+# Message states in the outbox
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+def _utcnow():
+    """Current UTC time as a naive datetime, the way the outbox stores it."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def build_message(receiver_email, subject, message):
+    """Build the MIME message for one email."""
+    email_message = EmailMessage()
+    email_message["From"] = sender_email
+    email_message["To"] = receiver_email
+    email_message["Subject"] = subject
+    email_message.set_content(message)
+    return email_message
+
+
+def open_connection():
+    """Open an SMTP connection, upgraded to TLS and logged in as configured."""
+    server = smtplib.SMTP(smtp_server, port=port, timeout=SMTP_TIMEOUT_SECONDS)
+    try:
+        if use_starttls:
+            server.starttls(context=ssl.create_default_context())  # Secure the connection
+        if use_login:
+            server.login(sender_email, password)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retrying a message that has failed `attempts` times."""
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+
+class SMTPWorker(threading.Thread):
+    """Background thread delivering outbox messages over one reused SMTP connection."""
+
+    def __init__(self, queue, name):
+        """Create a worker pulling from the given EmailQueue."""
+        super().__init__(name=name, daemon=True)
+        self.queue = queue
+        self.server = None
+        self.last_used = 0.0
+        # Messages delivered whose sent status could not be written; they stay
+        # claimed by this worker and must not be delivered again
+        self.unrecorded = set()
+
+    def run(self):
+        """Deliver batches until the queue is stopped."""
+        while not self.queue.stopping.is_set():
+            self.queue.wakeup.clear()
+            try:
+                batch = self.queue.claim_batch(self.name)
+            except Exception:
+                logger.warning("Email outbox unavailable", exc_info=True)
+                batch = []
+            try:
+                if batch:
+                    for row in batch:
+                        self.deliver(row)
+                    continue
+                if self.server and time.monotonic() - self.last_used > IDLE_DISCONNECT_SECONDS:
+                    self.disconnect()
+            except Exception:
+                # An unexpected error must not end the thread; nothing else would restart it
+                logger.warning("Email worker iteration failed", exc_info=True)
+                self.disconnect()
+            self.queue.wakeup.wait(POLL_INTERVAL_SECONDS)
+        self.disconnect()
 
-port = 587
-smtp_server = "smtp.gmail.com"
+    def deliver(self, row):
+        """Send one claimed message, reconnecting once if the server dropped us."""
+        if row.id in self.unrecorded:
+            # Already delivered; only recording that failed
+            self.record_sent(row.id)
+            return
+        email_message = build_message(row.recipient, row.subject, row.body)
+        started = time.perf_counter()
+        try:
+            for attempt in range(2):
+                try:
+                    if self.server is None:
+                        self.server = open_connection()
+                    self.server.send_message(email_message)
+                    break
+                except smtplib.SMTPServerDisconnected:
+                    # Idle connections get closed by the server; retry on a fresh one
+                    self.server = None
+                    if attempt:
+                        raise
+        except Exception as e:
+            metrics.observe_outbound("smtp", time.perf_counter() - started, failed=True)
+            logger.warning("Delivering email failed", extra={"outbox_id": row.id, "attempt": row.attempts + 1})
+            self.disconnect()
+            self.record_failed(row, str(e))
+            return
+        self.last_used = time.monotonic()
+        metrics.observe_outbound("smtp", time.perf_counter() - started)
+        self.record_sent(row.id)
+
+    def record_sent(self, message_id):
+        """Mark a delivered message sent; if that fails, retry only the marking with the next batch."""
+        try:
+            self.queue.mark_sent(message_id)
+        except Exception:
+            logger.warning("Recording sent email failed", exc_info=True, extra={"outbox_id": message_id})
+            self.unrecorded.add(message_id)
+        else:
+            self.unrecorded.discard(message_id)
+
+    def record_failed(self, row, error):
+        """Schedule a failed message's retry; if that fails, it stays claimed and is retried with the next batch."""
+        try:
+            self.queue.mark_failed(row.id, row.attempts + 1, error)
+        except Exception:
+            logger.warning("Recording failed email failed", exc_info=True, extra={"outbox_id": row.id})
+
+    def disconnect(self):
+        """Close the SMTP connection if one is open."""
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except Exception:
+                pass
+            self.server = None
+
+
+class EmailQueue:
+    """Persistent outbox of emails plus the worker pool delivering it."""
+
+    def __init__(self, engine, workers=WORKER_COUNT):
+        """Create a queue backed by the email_outbox table of the given engine."""
+        self.engine = engine
+        self.worker_count = workers
+        self.workers = []
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+
+    def start(self):
+        """Start the workers."""
+        self.stopping.clear()
+        self.workers = [SMTPWorker(self, f"smtp-worker-{uuid.uuid4().hex[:8]}") for _ in range(self.worker_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout=None):
+        """Stop the workers after their current message."""
+        self.stopping.set()
+        self.wakeup.set()
+        for worker in self.workers:
+            worker.join(timeout)
+        self.workers = []
+
+    def enqueue(self, receiver_email, subject, message, connection=None):
+        """
+        Record an email for background delivery.
+        Args:
+            receiver_email (str): The recipient.
+            subject (str): The subject line.
+            message (str): The plain text body.
+            connection: Optional connection whose transaction the email should
+                be queued in; by default a transaction of its own is used.
+        Returns:
+            bool: True, the email was queued.
+        """
+        if connection is None:
+            with self.engine.begin() as connection:
+                self._insert(connection, receiver_email, subject, message)
+        else:
+            self._insert(connection, receiver_email, subject, message)
+        self.wakeup.set()
+        return True
+
+    def _insert(self, connection, receiver_email, subject, message):
+        """Insert one outbox row, see enqueue."""
+        now = _utcnow()
+        connection.execute(insert(outbox).values(
+            recipient=receiver_email,
+            subject=subject,
+            body=message,
+            status=PENDING,
+            attempts=0,
+            created_at=now,
+            next_attempt_at=now,
+        ))
+
+    def claim_batch(self, worker_name, size=BATCH_SIZE):
+        """
+        Atomically mark up to size due messages as being sent by this worker and return them.
+        Messages claimed by a worker that died without finishing are reclaimed
+        after STALE_CLAIM_SECONDS.
+        """
+        now = _utcnow()
+        due = (
+            select(outbox.c.id)
+            .where(or_(
+                and_(outbox.c.status == PENDING, outbox.c.next_attempt_at <= now),
+                and_(outbox.c.status == SENDING, outbox.c.claimed_at < now - timedelta(seconds=STALE_CLAIM_SECONDS)),
+            ))
+            .order_by(outbox.c.id)
+            .limit(size)
+        )
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(outbox)
+                .where(outbox.c.id.in_(due))
+                .values(status=SENDING, claimed_by=worker_name, claimed_at=now)
+            )
+            return connection.execute(
+                select(outbox.c.id, outbox.c.recipient, outbox.c.subject, outbox.c.body, outbox.c.attempts)
+                .where(outbox.c.status == SENDING, outbox.c.claimed_by == worker_name)
+                .order_by(outbox.c.id)
+            ).all()
+
+    def mark_sent(self, message_id):
+        """Record a successful delivery."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(outbox)
+                .where(outbox.c.id == message_id)
+                .values(status=SENT, sent_at=_utcnow(), claimed_by=None)
+            )
+
+    def mark_failed(self, message_id, attempts, error):
+        """Record a failed attempt and schedule a retry, or give up after MAX_ATTEMPTS."""
+        with self.engine.begin() as connection:
+            connection.execute(
+                update(outbox)
+                .where(outbox.c.id == message_id)
+                .values(
+                    status=FAILED if attempts >= MAX_ATTEMPTS else PENDING,
+                    attempts=attempts,
+                    next_attempt_at=_utcnow() + timedelta(seconds=backoff_delay(attempts)),
+                    last_error=error[:500],
+                    claimed_by=None,
+                )
+            )
+
+
+# Queue used by send_email once the app has configured it
+_queue = None
+
+
+def configure(engine, workers=WORKER_COUNT):
+    """Route send_email through a background queue on the given engine and start it."""
+    global _queue
+    _queue = EmailQueue(engine, workers)
+    _queue.start()
+    return _queue
+
+
+def send_email(receiver_email, subject, message, connection=None):
+    """
+    Send an email using Gmail's SMTP server.
+    Once configure() has been called the email is queued and delivered in the
+    background, see EmailQueue.enqueue; otherwise (scripts, the REPL) it is
+    sent synchronously.
+    """
+    if _queue is not None:
+        return _queue.enqueue(receiver_email, subject, message, connection)
 
-def send_email(receiver_email, subject, message):
-    """Function to send an email using Gmail's SMTP server"""
-    email_message = f"Subject: {subject}\n\n{message}"
-    
-    # Connect to the server
-    context = ssl.create_default_context()
     try:
-        server = smtplib.SMTP(smtp_server,port=port)
-        server.starttls(context=context) # Secure the connection
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, email_message)
-    except Exception as e:
-        print(e)
+        server = open_connection()
+    except Exception:
+        logger.warning("Could not connect to the SMTP server", exc_info=True)
+        return False
+    try:
+        server.send_message(build_message(receiver_email, subject, message))
+        return True
+    except Exception:
+        logger.warning("Sending email failed", exc_info=True)
+        return False
     finally:
-        server.quit() 
-    
+        server.quit()
+
 # Example usage
-# send_email("kaizheng31@gmail.com", "Test Subject", "This is a test message.")
\ No newline at end of file
+# send_email("kaizheng31@gmail.com", "Test Subject", "This is a test message.")
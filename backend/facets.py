@@ -0,0 +1,160 @@
+"""Incrementally maintained facet counts for the listing sidebar filters."""
+
+from collections import Counter
+from sqlalchemy import inspect, text
+
+# Facet name in API responses -> Item column it counts
+FACET_COLUMNS = {
+    "condition": "condition",
+    "color": "color",
+    "type": "item_type",
+    "isCustom": "is_custom",
+}
+
+# Facet counting listings per category; stored with the category as the value
+CATEGORY_FACET = "category"
+
+UPSERT_SQL = (
+    "INSERT INTO item_facet_count (category, facet, value, count) "
+    "VALUES (:category, :facet, :value, :delta) "
+    "ON CONFLICT (category, facet, value) DO UPDATE SET count = item_facet_count.count + excluded.count"
+)
+
+
+def facet_value(value):
+    """Normalize a column value into the string stored in the facet table."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def _facet_rows(values):
+    """Yield (facet, value) pairs for an item given its column values."""
+    yield CATEGORY_FACET, facet_value(values["category"])
+    for facet, column in FACET_COLUMNS.items():
+        yield facet, facet_value(values[column])
+
+
+def _apply(connection, values, delta):
+    """Add delta to every facet count the item with these column values falls under."""
+    category = values["category"]
+    params = [
+        {"category": category, "facet": facet, "value": value, "delta": delta}
+        for facet, value in _facet_rows(values)
+        if value is not None
+    ]
+    connection.execute(text(UPSERT_SQL), params)
+
+
+def count_items(connection, rows):
+    """Count items inserted without the ORM (e.g. by bulk import), one upsert per facet value."""
+    deltas = Counter()
+    for row in rows:
+        for facet, value in _facet_rows(row):
+            if value is not None:
+                deltas[(row["category"], facet, value)] += 1
+    if deltas:
+        connection.execute(text(UPSERT_SQL), [
+            {"category": category, "facet": facet, "value": value, "delta": delta}
+            for (category, facet, value), delta in deltas.items()
+        ])
+
+
+def _current_values(target):
+    """Column values of an item as they are after the flush."""
+    return {column: getattr(target, column) for column in ("category", *FACET_COLUMNS.values())}
+
+
+def _previous_values(target):
+    """Column values of an item as they were before the flush."""
+    state = inspect(target)
+    values = {}
+    for column in ("category", *FACET_COLUMNS.values()):
+        history = state.attrs[column].history
+        values[column] = history.deleted[0] if history.deleted else getattr(target, column)
+    return values
+
+
+def rebuild(connection):
+    """Recompute every facet count from the item table."""
+    connection.execute(text("DELETE FROM item_facet_count"))
+    connection.execute(text(
+        "INSERT INTO item_facet_count (category, facet, value, count) "
+        "SELECT category, :facet, category, count(*) FROM item GROUP BY category"
+    ), {"facet": CATEGORY_FACET})
+    for facet, column in FACET_COLUMNS.items():
+        rows = connection.execute(text(
+            f"SELECT category, {column}, count(*) FROM item "
+            f"WHERE {column} IS NOT NULL GROUP BY category, {column}"
+        )).all()
+        if column == "is_custom":
+            # Raw SQL returns SQLite booleans as integers
+            rows = [(category, bool(value), count) for category, value, count in rows]
+        params = [
+            {"category": category, "facet": facet, "value": facet_value(value), "delta": count}
+            for category, value, count in rows
+            if facet_value(value) is not None
+        ]
+        if params:
+            connection.execute(text(UPSERT_SQL), params)
+
+
+def sync(engine):
+    """Rebuild the facet counts if they no longer add up to the number of items."""
+    with engine.begin() as connection:
+        counted = connection.execute(text(
+            "SELECT coalesce(sum(count), 0) FROM item_facet_count WHERE facet = :facet"
+        ), {"facet": CATEGORY_FACET}).scalar()
+        items = connection.execute(text("SELECT count(*) FROM item")).scalar()
+        if counted != items:
+            rebuild(connection)
+
+
+def get_counts(connection, category=None):
+    """
+    Read the facet counts for one category, or summed over all categories.
+    Args:
+        connection: SQLAlchemy connection or session to run the query on.
+        category (str): Category to count within, or None for the whole catalog.
+    Returns:
+        dict: facet name -> {value: count}. The category facet always covers
+        the whole catalog.
+    """
+    counts = {CATEGORY_FACET: {}, **{facet: {} for facet in FACET_COLUMNS}}
+    rows = connection.execute(text(
+        "SELECT facet, value, count FROM item_facet_count WHERE facet = :facet AND count > 0"
+    ), {"facet": CATEGORY_FACET})
+    for facet, value, count in rows:
+        counts[facet][value] = count
+
+    sql = "SELECT facet, value, sum(count) FROM item_facet_count WHERE facet != :facet"
+    params = {"facet": CATEGORY_FACET}
+    if category:
+        sql += " AND category = :category"
+        params["category"] = category
+    sql += " GROUP BY facet, value HAVING sum(count) > 0"
+    for facet, value, count in connection.execute(text(sql), params):
+        counts[facet][value] = count
+    return counts
+
+
+def on_item_insert(mapper, connection, target):
+    """Mapper hook counting a newly inserted item."""
+    _apply(connection, _current_values(target), 1)
+
+
+def on_item_update(mapper, connection, target):
+    """Mapper hook moving an item between facet values when its columns change."""
+    state = inspect(target)
+    columns = ("category", *FACET_COLUMNS.values())
+    if not any(state.attrs[column].history.has_changes() for column in columns):
+        return
+    _apply(connection, _previous_values(target), -1)
+    _apply(connection, _current_values(target), 1)
+
+
+def on_item_delete(mapper, connection, target):
+    """Mapper hook uncounting a deleted item."""
+    _apply(connection, _current_values(target), -1)
@@ -0,0 +1,128 @@
+"""
+Local verification of Google ID tokens with cached signing certificates.
+
+google-auth's verify_oauth2_token fetches Google's public certificates on
+every call. CertificateCache keeps them for as long as the Cache-Control
+max-age allows, refreshes them in a background thread shortly before they
+expire, and keeps serving the old set if a refresh fails, so verifying a
+token normally needs no network round-trip at all.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from google.auth import jwt as google_jwt
+import http_client
+
+CERTS_URL = os.environ.get("GOOGLE_CERTS_URL", "https://www.googleapis.com/oauth2/v1/certs")
+VALID_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# Used when the response carries no usable max-age
+DEFAULT_MAX_AGE_SECONDS = 3600
+# Refresh this long before expiry (at most half the lifetime)
+REFRESH_MARGIN_SECONDS = 300
+# Wait before retrying a failed background refresh
+RETRY_SECONDS = 30
+# Minimum time between refreshes triggered by an unknown key ID
+MIN_FORCED_REFRESH_SECONDS = 60
+CLOCK_SKEW_SECONDS = 10
+
+logger = logging.getLogger(__name__)
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+def max_age(response):
+    """Seconds the certificates in a response stay fresh, from Cache-Control and Age."""
+    match = _MAX_AGE.search(response.headers.get("Cache-Control", ""))
+    if not match:
+        return DEFAULT_MAX_AGE_SECONDS
+    age = response.headers.get("Age", "0")
+    return max(int(match.group(1)) - (int(age) if age.isdigit() else 0), 0)
+
+
+class CertificateCache:
+    """Google's signing certificates, kept fresh by a background thread."""
+
+    def __init__(self, url=CERTS_URL, session=None):
+        """Create an empty cache fetching from url."""
+        self.url = url
+        self.session = session or http_client.get_session("google")
+        self.certs = {}
+        self.expires_at = 0.0
+        self.fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refresher = None
+        self._stopping = threading.Event()
+
+    def fetch(self):
+        """Download the certificates and return how long they stay fresh."""
+        response = self.session.get(self.url)
+        response.raise_for_status()
+        lifetime = max_age(response)
+        with self._lock:
+            self.certs = response.json()
+            self.fetched_at = time.monotonic()
+            self.expires_at = self.fetched_at + lifetime
+        return lifetime
+
+    def get(self):
+        """Return the certificates, fetching them first if they are missing or expired."""
+        with self._lock:
+            fresh = self.certs and time.monotonic() < self.expires_at
+            certs = self.certs
+        if fresh:
+            return certs
+        try:
+            self.fetch()
+        except Exception:
+            if not certs:
+                raise
+            # Google is unreachable; keys rotate slowly, so keep using the old set
+        return self.certs
+
+    def start(self):
+        """Fetch the certificates now and keep refreshing them before they expire."""
+        if self._refresher is not None:
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name="google-certs", daemon=True)
+        self._refresher.start()
+
+    def stop(self):
+        """Stop the background refresh."""
+        self._stopping.set()
+
+    def _refresh_loop(self):
+        """Refresh the certificates a margin before each expiry."""
+        delay = 0
+        while not self._stopping.wait(delay):
+            try:
+                lifetime = self.fetch()
+                delay = max(lifetime - min(REFRESH_MARGIN_SECONDS, lifetime / 2), 1)
+            except Exception:
+                logger.warning("Refreshing Google certificates failed", exc_info=True)
+                delay = RETRY_SECONDS
+
+    def verify(self, token, audience):
+        """
+        Verify a Google ID token's signature, expiry, audience and issuer in-process.
+        Args:
+            token (str): The encoded ID token.
+            audience (str): The expected OAuth client ID.
+        Returns:
+            dict: The token's claims.
+        Raises:
+            ValueError: If the token is invalid.
+        """
+        certs = self.get()
+        key_id = google_jwt.decode_header(token).get("kid")
+        if key_id not in certs and time.monotonic() - self.fetched_at > MIN_FORCED_REFRESH_SECONDS:
+            # Google rotated its keys before our copy expired
+            self.fetch()
+            certs = self.certs
+        claims = google_jwt.decode(token, certs=certs, audience=audience, clock_skew_in_seconds=CLOCK_SKEW_SECONDS)
+        if claims.get("iss") not in VALID_ISSUERS:
+            raise ValueError(f"Wrong issuer: {claims.get('iss')}")
+        return claims
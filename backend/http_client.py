@@ -0,0 +1,196 @@
+"""
+Shared outbound HTTP layer for third-party calls (imgbb, Google).
+
+Each remote service gets one pooled keep-alive requests.Session with bounded
+timeouts, retries on connection errors and gateway failures, a circuit
+breaker that fails fast while the service is down, an optional cap on
+concurrent calls, and call metrics.
+Base URLs are configurable so the calls can be pointed at a local stub.
+"""
+
+import threading
+import time
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) timeout in seconds used when the caller gives none or a longer one
+DEFAULT_TIMEOUT = (3.05, 15)
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF_FACTOR = 0.3
+DEFAULT_POOL_SIZE = 10
+
+# Consecutive failures that open the circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT_SECONDS = 30
+
+# How long a call waits for a free slot of a capped service before giving up;
+# kept short because the waiting call holds a worker thread too
+SLOT_WAIT_SECONDS = 0.1
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """Raised instead of calling a service whose circuit is open."""
+
+
+class ServiceBusyError(requests.ConnectionError):
+    """Raised when every concurrent-call slot of a service is taken."""
+
+
+class CircuitBreaker:
+    """
+    Closed while calls succeed; opens after FAILURE_THRESHOLD consecutive
+    failures and rejects calls for RESET_TIMEOUT_SECONDS; then lets a single
+    trial call through (half open) which closes or reopens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT_SECONDS):
+        """Create a closed breaker."""
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Return True if a call may go through now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        """Close the circuit after a successful call."""
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Count a failed call, opening the circuit if there were too many."""
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class InstrumentedSession(requests.Session):
+    """requests.Session applying the timeout, circuit breaker and metrics to every call."""
+
+    def __init__(self, name, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, pool_size=DEFAULT_POOL_SIZE, max_concurrent=None):
+        """
+        Create a pooled session for the named service.
+        max_concurrent caps the calls in flight, so a slow service can only
+        tie up that many of the server's worker threads.
+        """
+        super().__init__()
+        self.name = name
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=(502, 503, 504),
+                raise_on_status=False,
+            ),
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.busy = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+
+    def request(self, method, url, *args, **kwargs):
+        """Send a request unless the service is busy or its circuit is open, recording its outcome."""
+        # The slot is taken first: allow() may turn an open circuit half open,
+        # and the trial call it admits must then actually be made and recorded
+        if self.slots is not None and not self.slots.acquire(timeout=SLOT_WAIT_SECONDS):
+            with self._lock:
+                self.busy += 1
+            raise ServiceBusyError(f"{self.name} is busy (too many calls in flight)")
+        try:
+            if not self.breaker.allow():
+                with self._lock:
+                    self.rejected += 1
+                raise CircuitOpenError(f"{self.name} is unavailable (circuit open)")
+
+            # Callers such as google-auth pass long timeouts of their own; cap them
+            timeout = kwargs.get("timeout")
+            if timeout is None or (isinstance(timeout, (int, float)) and timeout > sum(self.timeout)):
+                kwargs["timeout"] = self.timeout
+
+            start = time.perf_counter()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except requests.RequestException:
+                self._record(time.perf_counter() - start, failed=True)
+                raise
+        finally:
+            if self.slots is not None:
+                self.slots.release()
+        self._record(time.perf_counter() - start, failed=response.status_code >= 500)
+        return response
+
+    def _record(self, seconds, failed):
+        """Update the metrics and the circuit breaker after a call."""
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            if failed:
+                self.failures += 1
+        metrics.observe_outbound(self.name, seconds, failed)
+        if failed:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def stats(self):
+        """Return the call metrics and circuit state."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "busy": self.busy,
+                "avgSeconds": self.total_seconds / self.calls if self.calls else 0.0,
+                "maxSeconds": self.max_seconds,
+                "circuit": self.breaker.state,
+            }
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name, **options):
+    """Return the shared session for a service, creating it on first use."""
+    with _sessions_lock:
+        if name not in _sessions:
+            _sessions[name] = InstrumentedSession(name, **options)
+        return _sessions[name]
+
+
+def all_stats():
+    """Return the metrics of every service session."""
+    with _sessions_lock:
+        sessions = dict(_sessions)
+    return {name: session.stats() for name, session in sessions.items()}
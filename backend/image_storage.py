@@ -0,0 +1,350 @@
+"""
+Pluggable storage for uploaded photos.
+
+LocalImageStorage streams uploads to disk in chunks, names them by their
+SHA-256 so identical uploads are stored once, and renders WebP variants
+(a small thumbnail for listing grids and a large display copy) in a process
+pool. ImgbbImageStorage keeps the original behaviour of uploading to imgbb.
+IMAGE_STORAGE selects the backend ("imgbb" by default); the local backend
+needs IMAGE_PUBLIC_URL, the URL prefix its files are served under.
+"""
+
+import base64
+import hashlib
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import requests
+from http_client import ServiceBusyError, get_session
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it only originals are served
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# imgbb uploads in flight per process, a quarter of the worker threads by
+# default so the rest stay free for other requests. Uploads beyond the cap are
+# refused with 503 at once rather than queued, as a queued upload would hold a
+# worker thread just the same
+IMGBB_MAX_CONCURRENT = int(os.environ.get(
+    "IMGBB_MAX_CONCURRENT", max(1, int(os.environ.get("WEB_THREADS", "32")) // 4)
+))
+
+# Extensions accepted for uploads, by MIME type
+ALLOWED_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+}
+
+# Extension of each accepted Pillow image format
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "GIF": ".gif", "WEBP": ".webp"}
+
+# Leading bytes of each accepted format, checked when Pillow is not installed
+MAGIC_EXTENSIONS = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+# Variant name -> longest side in pixels
+VARIANT_SIZES = {
+    "thumb": 400,
+    "large": 1280,
+}
+VARIANT_WORKERS = 2
+
+# Uploads arrive on request threads, and a process forked from a threaded
+# worker can inherit locks another thread was holding; start the pool's
+# processes from a separate single-threaded server instead. That server and
+# its children import the main module again, so it must not start services
+# at import (see app.start_services)
+VARIANT_START_METHOD = "forkserver"
+
+# Names of files served from the local store: <sha256>.<ext> or <sha256>_<variant>.webp
+ORIGINAL_NAME = re.compile(r"^([0-9a-f]{64})(\.[a-z]+)$")
+STORED_NAME = re.compile(r"^[0-9a-f]{64}(\.[a-z]+|_[a-z]+\.webp)$")
+
+# Backend used when IMAGE_STORAGE is unset
+DEFAULT_BACKEND = "imgbb"
+
+StoredImage = namedtuple("StoredImage", ["url", "thumbnail_url"])
+
+logger = logging.getLogger(__name__)
+
+
+class UploadError(Exception):
+    """Raised when an upload is rejected or cannot be stored."""
+
+    def __init__(self, message, status=400):
+        """Create an error reported to the client with the given HTTP status."""
+        super().__init__(message)
+        self.status = status
+
+
+def upload_extension(file):
+    """Pick the file extension for an upload, rejecting non-image types."""
+    extension = ALLOWED_TYPES.get(file.mimetype)
+    if extension is None:
+        guessed = os.path.splitext(file.filename or "")[1].lower()
+        if guessed == ".jpeg":
+            guessed = ".jpg"
+        if guessed not in ALLOWED_TYPES.values():
+            raise UploadError("Unsupported image type")
+        extension = guessed
+    return extension
+
+
+def image_extension(path):
+    """
+    Check that a file really is an image of an accepted format.
+    Args:
+        path (str): The uploaded file.
+    Returns:
+        str: The extension of the image's actual format.
+    Raises:
+        UploadError: If the content is not such an image.
+    """
+    if Image is not None:
+        try:
+            with Image.open(path) as image:
+                image.verify()
+                extension = FORMAT_EXTENSIONS.get(image.format)
+        except Exception:
+            extension = None
+    else:
+        with open(path, "rb") as file:
+            head = file.read(12)
+        extension = next((ext for magic, ext in MAGIC_EXTENSIONS if head.startswith(magic)), None)
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            extension = ".webp"
+    if extension is None:
+        raise UploadError("File is not a valid image")
+    return extension
+
+
+def make_variants(original_path, directory, digest):
+    """
+    Render the WebP variants of one original. Runs in a worker process.
+    Args:
+        original_path (str): Path of the stored original.
+        directory (str): Directory the variants are written to.
+        digest (str): SHA-256 of the original, used to name the variants.
+    """
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for variant, size in VARIANT_SIZES.items():
+            path = os.path.join(directory, f"{digest}_{variant}.webp")
+            if os.path.exists(path):
+                continue
+            copy = image.copy()
+            copy.thumbnail((size, size))
+            # Write under a temporary name so a half-written file is never served
+            partial = f"{path}.partial"
+            copy.save(partial, "WEBP", quality=80, method=4)
+            os.replace(partial, path)
+
+
+def storage_settings():
+    """
+    Read the image storage settings from the environment.
+    Returns:
+        tuple: The backend name, and the public URL of the local backend (else None).
+    """
+    backend = os.environ.get("IMAGE_STORAGE", DEFAULT_BACKEND)
+    public_url = os.environ.get("IMAGE_PUBLIC_URL") if backend == "local" else None
+    return backend, public_url.rstrip("/") if public_url else None
+
+
+def local_thumbnail_url(public_url, image_url):
+    """Map the URL of an original stored locally under public_url to its thumbnail, or None."""
+    if not image_url or not image_url.startswith(public_url + "/"):
+        return None
+    match = ORIGINAL_NAME.match(image_url[len(public_url) + 1:])
+    if not match:
+        return None
+    return f"{public_url}/{match.group(1)}_thumb.webp"
+
+
+def _log_variant_failure(future, path):
+    """Log a variant rendering that failed; the original is served in its place."""
+    error = future.exception()
+    if error is not None:
+        logger.warning("Rendering variants of %s failed", path, exc_info=error)
+
+
+class ImageStorage(ABC):
+    """Interface of an image storage backend."""
+
+    @abstractmethod
+    def save(self, file):
+        """
+        Store an uploaded image.
+        Args:
+            file (FileStorage): The uploaded file.
+        Returns:
+            StoredImage: URLs of the original and of its thumbnail.
+        Raises:
+            UploadError: If the upload is rejected or cannot be stored.
+        """
+
+    def thumbnail_url(self, image_url):
+        """Return the thumbnail URL for an image this backend stored, or None."""
+        return None
+
+
+class LocalImageStorage(ImageStorage):
+    """Content-addressed image store on the local filesystem."""
+
+    def __init__(self, directory, public_url):
+        """
+        Create a store writing to directory and served under public_url.
+        Args:
+            directory (str): Where originals and variants are written.
+            public_url (str): URL prefix the files are served from.
+        """
+        self.directory = directory
+        self.public_url = public_url.rstrip("/")
+        os.makedirs(directory, exist_ok=True)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _variant_pool(self):
+        """Start the process pool rendering variants on first use."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=VARIANT_WORKERS,
+                    mp_context=multiprocessing.get_context(VARIANT_START_METHOD),
+                )
+            return self._pool
+
+    def save(self, file):
+        """Stream the upload to disk while hashing it, check that it is an image, then queue its variants."""
+        upload_extension(file)
+        digest = hashlib.sha256()
+        size = 0
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, suffix=".upload")
+        try:
+            with os.fdopen(handle, "wb") as out:
+                while True:
+                    chunk = file.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > MAX_UPLOAD_BYTES:
+                        raise UploadError("Image is too large")
+                    digest.update(chunk)
+                    out.write(chunk)
+            if size == 0:
+                raise UploadError("Empty file")
+            # Stored under the extension of what it really is, not what it claimed
+            extension = image_extension(temp_path)
+
+            name = digest.hexdigest()
+            path = os.path.join(self.directory, name + extension)
+            if os.path.exists(path):
+                # Same bytes uploaded before; keep the existing copy
+                os.remove(temp_path)
+            else:
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        if Image is not None:
+            future = self._variant_pool().submit(make_variants, path, self.directory, name)
+            future.add_done_callback(lambda done: _log_variant_failure(done, path))
+        return StoredImage(
+            url=f"{self.public_url}/{name}{extension}",
+            thumbnail_url=f"{self.public_url}/{name}_thumb.webp",
+        )
+
+    def thumbnail_url(self, image_url):
+        """Map the URL of a locally stored original to its thumbnail."""
+        return local_thumbnail_url(self.public_url, image_url)
+
+    def resolve(self, name):
+        """
+        Find the file to serve for a stored name.
+        A variant that has not been rendered yet (or cannot be, without
+        Pillow) falls back to its original.
+        Args:
+            name (str): The file name from the URL.
+        Returns:
+            str: File name inside the directory, or None if nothing matches.
+        """
+        if not STORED_NAME.match(name):
+            return None
+        if os.path.exists(os.path.join(self.directory, name)):
+            return name
+        digest = name[:64]
+        for extension in ALLOWED_TYPES.values():
+            original = digest + extension
+            if os.path.exists(os.path.join(self.directory, original)):
+                return original
+        return None
+
+
+class ImgbbImageStorage(ImageStorage):
+    """Backend uploading images to imgbb."""
+
+    def __init__(self, api_key, upload_url="https://api.imgbb.com/1/upload"):
+        """Create a backend uploading with the given imgbb API key."""
+        self.api_key = api_key
+        self.upload_url = upload_url
+        self.session = get_session("imgbb", max_concurrent=IMGBB_MAX_CONCURRENT)
+
+    def save(self, file):
+        """Upload the image to imgbb; its thumb rendition is the thumbnail."""
+        upload_extension(file)
+        data = file.stream.read(MAX_UPLOAD_BYTES + 1)
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise UploadError("Image is too large")
+        payload = {
+            "key": self.api_key,
+            "image": base64.b64encode(data),
+        }
+        try:
+            response = self.session.post(self.upload_url, data=payload)
+        except ServiceBusyError:
+            raise UploadError("Too many uploads in progress, try again shortly", status=503)
+        except requests.RequestException:
+            raise UploadError("Image host unavailable", status=503)
+        if response.status_code != 200:
+            raise UploadError("Failed to upload to imgbb", status=500)
+        data = response.json()["data"]
+        return StoredImage(url=data["url"], thumbnail_url=data.get("thumb", {}).get("url", data["url"]))
+
+
+def create_storage(instance_path):
+    """Create the backend selected by the IMAGE_STORAGE environment variable."""
+    backend, public_url = storage_settings()
+    if backend == "imgbb":
+        return ImgbbImageStorage(
+            os.environ.get("IMGBB_API_KEY", "aaeb2e69efbfbf1b37e059229378b797"),
+            os.environ.get("IMGBB_UPLOAD_URL", "https://api.imgbb.com/1/upload"),
+        )
+    if backend == "local":
+        if not public_url:
+            # A guessed URL would be written into every listing
+            raise ValueError("IMAGE_PUBLIC_URL must be set when IMAGE_STORAGE is local")
+        return LocalImageStorage(
+            os.environ.get("IMAGE_STORAGE_DIR", os.path.join(instance_path, "uploads")),
+            public_url,
+        )
+    raise ValueError(f"Unknown IMAGE_STORAGE backend: {backend}")
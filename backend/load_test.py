@@ -0,0 +1,353 @@
+"""
+Reproducible load test of the SpartanSwap API.
+
+Seeds a synthetic SQLite database with a fixed random seed, starts the app
+in-process on a threaded server with Google, imgbb and SMTP replaced by local
+stubs, and drives each endpoint with a pool of concurrent clients carrying
+locally minted JWTs. Latency percentiles and throughput are printed as JSON
+so runs on different commits can be compared.
+
+Usage:
+    python load_test.py --rows 100000 --concurrency 16 --duration 20 --output run.json
+
+Seeded databases are kept in --data-dir and reused by later runs of the
+same size. Needs environment.py like the app itself.
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import random
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import jwt
+import requests
+
+SEED = 493
+USERS = 200
+CATEGORIES = ("Books", "Electronics", "Home Goods", "Clothing", "Tickets", "Sports")
+ITEM_TYPES = ("Textbook", "Laptop", "Lamp", "Hoodie", "Concert", "Bike")
+COLORS = ("Red", "Blue", "Green", "Black", "White")
+CONDITIONS = ("New", "Like New", "Used")
+
+ENDPOINTS = ("products", "product", "user", "add_listing")
+
+
+class StubHTTPHandler(BaseHTTPRequestHandler):
+    """Stands in for Google's certificate endpoint and the imgbb upload API."""
+
+    def do_GET(self):
+        """Serve an empty certificate set; load test tokens never reach Google."""
+        self._reply({})
+
+    def do_POST(self):
+        """Accept an imgbb upload without storing it."""
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        url = f"http://{self.headers['Host']}/image.jpg"
+        self._reply({"data": {"url": url, "thumb": {"url": url}}})
+
+    def _reply(self, payload):
+        """Send a JSON response."""
+        body = json.dumps(payload).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Cache-Control", "max-age=86400")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Keep the stub quiet."""
+
+
+class StubSMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server accepting and discarding every message."""
+
+    def handle(self):
+        """Answer each command of one SMTP session."""
+        self.wfile.write(b"220 localhost stub\r\n")
+        in_data = False
+        for line in self.rfile:
+            if in_data:
+                if line.rstrip(b"\r\n") == b".":
+                    in_data = False
+                    self.wfile.write(b"250 OK\r\n")
+                continue
+            command = line[:4].upper()
+            if command == b"DATA":
+                in_data = True
+                self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+            elif command == b"QUIT":
+                self.wfile.write(b"221 Bye\r\n")
+                return
+            else:
+                self.wfile.write(b"250 OK\r\n")
+
+
+class StubSMTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """Threaded TCP server for StubSMTPHandler."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_in_background(server):
+    """Serve a server from a daemon thread and return its port."""
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def start_stubs():
+    """Start the stub services and point the app's configuration at them."""
+    http_port = start_in_background(ThreadingHTTPServer(("127.0.0.1", 0), StubHTTPHandler))
+    smtp_port = start_in_background(StubSMTPServer(("127.0.0.1", 0), StubSMTPHandler))
+    os.environ["GOOGLE_CERTS_URL"] = f"http://127.0.0.1:{http_port}/certs"
+    os.environ["IMAGE_STORAGE"] = "imgbb"
+    os.environ["IMGBB_UPLOAD_URL"] = f"http://127.0.0.1:{http_port}/upload"
+    os.environ["SMTP_HOST"] = "127.0.0.1"
+    os.environ["SMTP_PORT"] = str(smtp_port)
+    os.environ["SMTP_STARTTLS"] = "0"
+    os.environ["SMTP_LOGIN"] = "0"
+
+
+def random_item(rng, seller_id):
+    """Build the columns of one synthetic listing."""
+    category = rng.randrange(len(CATEGORIES))
+    return {
+        "seller_id": seller_id,
+        "item_type": ITEM_TYPES[category],
+        "category": CATEGORIES[category],
+        "color": rng.choice(COLORS),
+        "price": round(rng.uniform(1, 500), 2),
+        "condition": rng.choice(CONDITIONS),
+        "name": f"{rng.choice(COLORS)} {ITEM_TYPES[category]} {rng.randrange(10000)}",
+        "orders": rng.randrange(50),
+        "description": "Synthetic listing for load testing",
+        "is_custom": rng.random() < 0.1,
+    }
+
+
+def seed(db_instance, rows):
+    """Fill an empty database with USERS users and rows items, deterministically."""
+    rng = random.Random(SEED)
+    with db_instance.app.app_context():
+        if db_instance.get_user_by_sub("load-test-1") is not None:
+            return
+        for number in range(1, USERS + 1):
+            db_instance.add_user(
+                sub=f"load-test-{number}",
+                email=f"load{number}@case.edu",
+                name=f"Load Test {number}",
+            )
+    sellers = [db_instance.get_user_by_sub(f"load-test-{number}").id for number in range(1, USERS + 1)]
+    db_instance.bulk_add_items(random_item(rng, rng.choice(sellers)) for _ in range(rows))
+
+
+def mint_token(secret_key, user):
+    """Create the session JWT /signin would issue for a user."""
+    now = datetime.now().timestamp()
+    return jwt.encode(
+        {"sub": user.sub, "id": user.id, "name": user.name, "iat": now, "exp": now + 3600},
+        secret_key,
+        algorithm="HS256",
+    )
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def run_endpoint(name, base_url, tokens, item_count, concurrency, duration, requests_per_endpoint):
+    """
+    Drive one endpoint with concurrent clients.
+    Args:
+        name (str): One of ENDPOINTS.
+        base_url (str): Root URL of the server.
+        tokens (list): (user snapshot, JWT) pairs to authenticate with.
+        item_count (int): Number of seeded items, for picking product IDs.
+        concurrency (int): Number of concurrent clients.
+        duration (float): Seconds to run, if requests_per_endpoint is not set.
+        requests_per_endpoint (int): Total requests to send instead of running for a duration.
+    Returns:
+        dict: Request counts, error count, throughput and latency percentiles in ms.
+    """
+    deadline = time.perf_counter() + duration
+    remaining = [requests_per_endpoint] if requests_per_endpoint else None
+    lock = threading.Lock()
+
+    def take_turn():
+        """Return True while the client should send another request."""
+        if remaining is None:
+            return time.perf_counter() < deadline
+        with lock:
+            remaining[0] -= 1
+            return remaining[0] >= 0
+
+    def client(number):
+        """Send requests until the run is over; return latencies and errors."""
+        rng = random.Random(SEED + number)
+        session = requests.Session()
+        latencies = []
+        errors = 0
+        while take_turn():
+            user, token = rng.choice(tokens)
+            session.cookies.set("jwt_token", token)
+            if name == "products":
+                call = lambda: session.get(
+                    f"{base_url}/api/products",
+                    params={"category": rng.choice(CATEGORIES), "limit": 24, "sort": "newest"},
+                )
+            elif name == "product":
+                call = lambda: session.get(f"{base_url}/api/products/{rng.randrange(1, item_count + 1)}")
+            elif name == "user":
+                call = lambda: session.get(f"{base_url}/api/user")
+            else:
+                listing = random_item(rng, user.id)
+                call = lambda: session.put(f"{base_url}/api/add_listing", json={
+                    "id": user.id,
+                    "type": listing["item_type"],
+                    "category": listing["category"],
+                    "color": listing["color"],
+                    "price": listing["price"],
+                    "name": listing["name"],
+                    "orders": 0,
+                    "description": listing["description"],
+                    "isCustom": listing["is_custom"],
+                    "image_url": None,
+                })
+            start = time.perf_counter()
+            try:
+                response = call()
+                failed = response.status_code >= 400
+            except requests.RequestException:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+        return latencies, errors
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(client, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(errors for _, errors in results),
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            name: round(value * 1000, 2) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies, 0.50)),
+                ("p95", percentile(latencies, 0.95)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+    }
+
+
+def git_commit():
+    """Return the current commit hash, if this is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args(argv):
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000, help="items in the synthetic database (e.g. 1000, 100000, 1000000)")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients per endpoint")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to drive each endpoint")
+    parser.add_argument("--requests", type=int, default=None, help="requests per endpoint, instead of --duration")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma separated subset of " + ", ".join(ENDPOINTS))
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "spartanswap-load-test"),
+                        help="where seeded databases are kept between runs")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Parse the arguments, run the load test and print the report."""
+    args = parse_args(argv)
+    endpoints = [name for name in args.endpoints.split(",") if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        sys.exit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    # Keep stdout for the JSON report alone
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args, endpoints)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output + "\n")
+
+
+def run(args, endpoints):
+    """Seed, start the app, drive the endpoints and return the report."""
+
+    # Everything the app reads at import time has to be in place first
+    os.makedirs(args.data_dir, exist_ok=True)
+    database = os.path.join(args.data_dir, f"items-{args.rows}.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.abspath(database)
+    # All clients share one address; measure capacity, not the admission limits
+    os.environ.setdefault("RATE_LIMITING", "0")
+    os.environ.setdefault("MAX_IN_FLIGHT", "0")
+    start_stubs()
+
+    from werkzeug.serving import make_server
+    from app import app, db_instance, start_services
+    start_services()
+
+    seed_started = time.perf_counter()
+    seed(db_instance, args.rows)
+    seed_seconds = time.perf_counter() - seed_started
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    base_url = f"http://127.0.0.1:{start_in_background(server)}"
+
+    users = [db_instance.get_user_by_sub(f"load-test-{number}") for number in range(1, USERS + 1)]
+    tokens = [(user, mint_token(app.secret_key, user)) for user in users]
+
+    report = {
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "rows": args.rows,
+        "concurrency": args.concurrency,
+        "duration": None if args.requests else args.duration,
+        "requests_per_endpoint": args.requests,
+        "seed_seconds": round(seed_seconds, 2),
+        "endpoints": {},
+    }
+    for name in endpoints:
+        report["endpoints"][name] = run_endpoint(
+            name, base_url, tokens, args.rows, args.concurrency, args.duration, args.requests
+        )
+    server.shutdown()
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Logging configuration: JSON records written from a background thread.
+
+Loggers hand their records to a QueueHandler, which only appends to an
+in-memory queue, so a slow or full stdout never blocks a request. A
+QueueListener thread formats the records as one JSON object per line,
+tagged with the request ID of the request that produced them.
+
+Environment:
+    LOG_LEVEL     Root level (default INFO).
+    LOG_LEVELS    Per-logger levels, e.g. "db_class=WARNING,email_sender=DEBUG".
+    LOG_SAMPLING  Fraction of records below WARNING kept per logger, e.g.
+                  "access=0.1" to log one request in ten.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from flask import g, has_request_context
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener = None
+
+
+def _parse_pairs(value):
+    """Parse "name=value,name=value" into a dict."""
+    pairs = {}
+    for part in (value or "").split(","):
+        if "=" in part:
+            name, setting = part.split("=", 1)
+            pairs[name.strip()] = setting.strip()
+    return pairs
+
+
+class RequestContextFilter(logging.Filter):
+    """Tag records with the ID of the request being handled, if any."""
+
+    def filter(self, record):
+        """Add request_id to the record; runs in the thread that logged it."""
+        if not hasattr(record, "request_id"):
+            record.request_id = g.get("request_id") if has_request_context() else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep only a fraction of the routine records of high-volume loggers."""
+
+    def __init__(self, rates):
+        """
+        Create a filter with per-logger sampling rates.
+        Args:
+            rates (dict): Logger name -> fraction of records to keep.
+        """
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        """Drop the record with the logger's sampling probability; warnings are always kept."""
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+class JsonQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting, apart from the exception text, to the listener."""
+
+    def prepare(self, record):
+        """Merge the message arguments and render the traceback before the record is queued."""
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single-line JSON object."""
+
+    def format(self, record):
+        """Render the record with its extra fields and any exception."""
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in _STANDARD_ATTRIBUTES and name not in entry:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure(stream=None):
+    """
+    Route all logging through a queue to a JSON stream handler. Safe to call twice.
+    Args:
+        stream: Where the records are written (stderr by default).
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter())
+
+    records = queue.SimpleQueue()
+    handler = JsonQueueHandler(records)
+    # Filters on the queue handler run in the thread that logs, where the
+    # request context is still available
+    handler.addFilter(SamplingFilter({
+        name: float(rate) for name, rate in _parse_pairs(os.environ.get("LOG_SAMPLING")).items()
+    }))
+    handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+    for name, level in _parse_pairs(os.environ.get("LOG_LEVELS")).items():
+        logging.getLogger(name).setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(records, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
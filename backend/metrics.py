@@ -0,0 +1,212 @@
+"""
+In-process metrics exposed in the Prometheus text format at /metrics.
+
+Request latency per route, SQL statements and time per request (counted
+through SQLAlchemy cursor events), outbound call latency per service and
+the cache counters are kept in this process; each worker process is
+scraped separately.
+"""
+
+import threading
+import time
+from flask import g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Upper bounds of the statements-per-request histogram buckets
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def _escape(value):
+    """Escape a label value for the text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    """Render a label set such as {route="/api/user",method="GET"}."""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    """Render a sample value."""
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names."""
+
+    def __init__(self, name, help, labels=()):
+        """Create a counter with no samples."""
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        """Add amount to the sample with the given labels."""
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        """Return the counter in the text format."""
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets and a fixed set of label names."""
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """Create a histogram with no observations."""
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        """Record one observation."""
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[position] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        """Return the histogram in the text format."""
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = 'le="' + (bound if bound == "+Inf" else repr(float(bound))) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(values[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {cumulative}")
+        return lines
+
+
+request_latency = Histogram(
+    "spartanswap_http_request_duration_seconds", "Time to handle a request, by route.", ("route", "method")
+)
+requests_total = Counter(
+    "spartanswap_http_requests_total", "Requests handled, by route and status.", ("route", "method", "status")
+)
+request_statements = Histogram(
+    "spartanswap_http_request_sql_statements", "SQL statements run per request, by route.",
+    ("route", "method"), buckets=STATEMENT_BUCKETS,
+)
+request_sql_time = Histogram(
+    "spartanswap_http_request_sql_seconds", "Time spent in SQL per request, by route.", ("route", "method")
+)
+statements_total = Counter("spartanswap_sql_statements_total", "SQL statements run by this process.")
+statement_seconds = Counter("spartanswap_sql_seconds_total", "Time spent running SQL statements.")
+outbound_latency = Histogram(
+    "spartanswap_outbound_call_duration_seconds", "Time of calls to third-party services.", ("service",)
+)
+outbound_failures = Counter(
+    "spartanswap_outbound_call_failures_total", "Failed calls to third-party services.", ("service",)
+)
+admission_rejections = Counter(
+    "spartanswap_admission_rejections_total", "Requests refused by rate limits or load shedding.",
+    ("endpoint", "reason"),
+)
+
+REGISTRY = [
+    request_latency, requests_total, request_statements, request_sql_time,
+    statements_total, statement_seconds, outbound_latency, outbound_failures,
+    admission_rejections,
+]
+
+
+def observe_outbound(service, seconds, failed=False):
+    """Record one call to a third-party service."""
+    outbound_latency.observe(seconds, service=service)
+    if failed:
+        outbound_failures.inc(service=service)
+
+
+def start_request():
+    """Start measuring the current request."""
+    g.metrics_started = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0.0
+
+
+def finish_request(route, method, status):
+    """Record the current request's latency and SQL use."""
+    started = g.get("metrics_started")
+    if started is None:
+        return
+    request_latency.observe(time.perf_counter() - started, route=route, method=method)
+    requests_total.inc(route=route, method=method, status=status)
+    request_statements.observe(g.sql_statements, route=route, method=method)
+    request_sql_time.observe(g.sql_seconds, route=route, method=method)
+
+
+def cache_lines(caches):
+    """
+    Render the counters of the in-process caches.
+    Args:
+        caches (dict): Cache name -> stats() dict with hits, misses and size.
+    Returns:
+        list: Lines in the text format.
+    """
+    lines = []
+    for metric, key, kind, help in (
+        ("spartanswap_cache_hits_total", "hits", "counter", "Cache lookups answered from the cache."),
+        ("spartanswap_cache_misses_total", "misses", "counter", "Cache lookups that missed."),
+        ("spartanswap_cache_entries", "size", "gauge", "Entries currently cached."),
+    ):
+        lines += [f"# HELP {metric} {help}", f"# TYPE {metric} {kind}"]
+        for name, stats in sorted(caches.items()):
+            lines.append(f'{metric}{{cache="{_escape(name)}"}} {stats[key]}')
+    return lines
+
+
+def render(caches):
+    """Return every metric in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines += metric.render()
+    lines += cache_lines(caches)
+    return "\n".join(lines) + "\n"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    """Remember when a statement started."""
+    connection.info["statement_started"] = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    """Count a finished statement, globally and for the current request."""
+    seconds = time.perf_counter() - connection.info.pop("statement_started")
+    statements_total.inc()
+    statement_seconds.inc(seconds)
+    if has_request_context() and "sql_statements" in g:
+        g.sql_statements += 1
+        g.sql_seconds += seconds
@@ -0,0 +1,162 @@
+"""
+Digest notifications telling sellers who looked them up.
+
+Looking up a seller only bumps a counter in the listing_view table. A
+background thread in every process periodically turns the pending counters
+into one digest email per seller and clears them, in the same transaction
+that queues the emails in the outbox. The transaction also stamps each
+seller's last_digest_at, and sellers sent a digest less than
+DIGEST_INTERVAL_SECONDS ago are skipped, so a seller gets at most one digest
+per interval however many processes are running.
+"""
+
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import DateTime, bindparam, delete, or_, select, text
+from db_class import ListingView, SellerDigest, User
+from email_sender import send_email
+
+# Least time between two digests to the same seller, and how often each
+# process looks for sellers that are due
+DIGEST_INTERVAL_SECONDS = 3600
+DIGEST_CHECK_SECONDS = 300
+
+# Most viewers named in one digest; the rest are only counted
+MAX_VIEWERS_LISTED = 20
+
+RECORD_VIEW_SQL = (
+    "INSERT INTO listing_view (seller_id, viewer_id, views, first_viewed_at, last_viewed_at) "
+    "VALUES (:seller_id, :viewer_id, 1, :now, :now) "
+    "ON CONFLICT (seller_id, viewer_id) DO UPDATE SET "
+    "views = listing_view.views + 1, last_viewed_at = :now"
+)
+
+MARK_DIGEST_SQL = (
+    "INSERT INTO seller_digest (seller_id, last_digest_at) VALUES (:seller_id, :now) "
+    "ON CONFLICT (seller_id) DO UPDATE SET last_digest_at = :now"
+)
+
+logger = logging.getLogger(__name__)
+
+listing_view = ListingView.__table__
+seller_digest = SellerDigest.__table__
+user = User.__table__
+
+
+def record_view(engine, seller_id, viewer_id):
+    """Count one lookup of a seller by a viewer, to be reported in the next digest."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    statement = text(RECORD_VIEW_SQL).bindparams(bindparam("now", type_=DateTime))
+    with engine.begin() as connection:
+        connection.execute(statement, {"seller_id": seller_id, "viewer_id": viewer_id, "now": now})
+
+
+def build_digest(seller_name, viewers):
+    """
+    Build the subject and body of one seller's digest.
+    Args:
+        seller_name (str): The seller's name.
+        viewers (list): (viewer name, view count) pairs, most views first.
+    Returns:
+        tuple: (subject, message)
+    """
+    total = sum(views for _, views in viewers)
+    lines = [f"- {name} ({views} view{'s' if views != 1 else ''})" for name, views in viewers[:MAX_VIEWERS_LISTED]]
+    if len(viewers) > MAX_VIEWERS_LISTED:
+        lines.append(f"- and {len(viewers) - MAX_VIEWERS_LISTED} more")
+    subject = f"{seller_name} : Listing Search"
+    message = (
+        f"{len(viewers)} user{'s' if len(viewers) != 1 else ''} searched for your listings "
+        f"{total} time{'s' if total != 1 else ''} since the last update:\n"
+        + "\n".join(lines)
+        + "\nThank you for using SpartanSwap!"
+    )
+    return subject, message
+
+
+def send_digests(engine, min_interval=DIGEST_INTERVAL_SECONDS):
+    """
+    Queue one digest email per seller with pending views who was not sent one
+    in the last min_interval seconds, and clear those views.
+    Returns:
+        int: The number of digests queued.
+    """
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    due = (
+        select(listing_view.c.seller_id)
+        .select_from(listing_view.outerjoin(seller_digest, seller_digest.c.seller_id == listing_view.c.seller_id))
+        .where(or_(
+            seller_digest.c.last_digest_at.is_(None),
+            seller_digest.c.last_digest_at <= now - timedelta(seconds=min_interval),
+        ))
+        .distinct()
+    )
+    with engine.begin() as connection:
+        # DELETE ... RETURNING claims the rows atomically, so digests from
+        # several processes never report the same views twice
+        pending = connection.execute(
+            delete(listing_view)
+            .where(listing_view.c.seller_id.in_(due))
+            .returning(listing_view.c.seller_id, listing_view.c.viewer_id, listing_view.c.views)
+        ).all()
+        if not pending:
+            return 0
+        # Stamped in the claiming transaction, so no other process sends these sellers a digest too soon
+        statement = text(MARK_DIGEST_SQL).bindparams(bindparam("now", type_=DateTime))
+        connection.execute(statement, [{"seller_id": seller_id, "now": now} for seller_id in {row.seller_id for row in pending}])
+
+        user_ids = {row.seller_id for row in pending} | {row.viewer_id for row in pending}
+        users = {
+            row.id: row
+            for row in connection.execute(
+                select(user.c.id, user.c.name, user.c.email).where(user.c.id.in_(user_ids))
+            )
+        }
+
+        by_seller = {}
+        for row in pending:
+            viewer = users.get(row.viewer_id)
+            by_seller.setdefault(row.seller_id, []).append((viewer.name if viewer else "A user", row.views))
+
+        sent = 0
+        for seller_id, viewers in by_seller.items():
+            seller = users.get(seller_id)
+            if seller is None:
+                continue
+            viewers.sort(key=lambda viewer: viewer[1], reverse=True)
+            subject, message = build_digest(seller.name, viewers)
+            send_email(seller.email, subject, message, connection=connection)
+            sent += 1
+        return sent
+
+
+class DigestWorker(threading.Thread):
+    """Background thread sending the digests that are due every DIGEST_CHECK_SECONDS."""
+
+    def __init__(self, engine, interval=DIGEST_CHECK_SECONDS):
+        """Create a worker sending digests from the given engine's database."""
+        super().__init__(name="listing-view-digest", daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.stopping = threading.Event()
+
+    def run(self):
+        """Send digests until stopped."""
+        while not self.stopping.wait(self.interval):
+            try:
+                send_digests(self.engine)
+            except Exception:
+                logger.warning("Sending listing view digests failed", exc_info=True)
+
+    def stop(self, timeout=None):
+        """Stop the worker."""
+        self.stopping.set()
+        self.join(timeout)
+
+
+def configure(engine, interval=DIGEST_CHECK_SECONDS):
+    """Start sending digests in the background."""
+    worker = DigestWorker(engine, interval)
+    worker.start()
+    return worker
@@ -0,0 +1,64 @@
+"""
+Sampling profiler for a single request.
+
+A background thread samples the stack of the thread handling the request at
+a fixed interval. The result is in the folded format ("frame;frame;frame
+count" per line) read by flamegraph.pl, speedscope and similar tools.
+Samples are only taken when the sampler gets the GIL, so CPU-bound code is
+sampled less often than the interval suggests.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL_SECONDS = 0.001
+
+
+def _frame_name(frame):
+    """Name a stack frame as file:function:line."""
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a background thread until stopped."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL_SECONDS):
+        """Create a profiler for the thread with the given identifier."""
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self.started_at = None
+        self.seconds = 0.0
+        self._stopping = threading.Event()
+        self._sampler = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        """Start sampling."""
+        self.started_at = time.perf_counter()
+        self._sampler.start()
+
+    def stop(self):
+        """Stop sampling and wait for the sampler to finish."""
+        self._stopping.set()
+        self._sampler.join()
+        self.seconds = time.perf_counter() - self.started_at
+
+    def _run(self):
+        """Record the target thread's stack every interval."""
+        while not self._stopping.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        """Return the samples as folded stacks, most frequent first."""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
@@ -0,0 +1,79 @@
+"""
+Debug-mode detector for N+1 query patterns.
+
+Counts the statements of each request by shape: the SQL text with literals
+removed and IN lists collapsed, so the same query for different rows has
+one shape. A shape repeated more than THRESHOLD times in one request is
+almost always a query issued once per row of an earlier result, and is
+reported ("log") or turned into an error ("raise") at the offending query.
+"""
+
+import logging
+import os
+import re
+from collections import Counter
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+OFF = "off"
+LOG = "log"
+RAISE = "raise"
+
+THRESHOLD = int(os.environ.get("QUERY_DETECTOR_THRESHOLD", "5"))
+
+_mode = OFF
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE = re.compile(r"\s+")
+
+
+class NPlusOneError(RuntimeError):
+    """Raised in "raise" mode when a request repeats a query shape too often."""
+
+
+def configure(mode):
+    """
+    Turn the detector on or off.
+    Args:
+        mode (str): OFF, LOG or RAISE.
+    """
+    global _mode
+    if mode not in (OFF, LOG, RAISE):
+        raise ValueError(f"Unknown query detector mode: {mode}")
+    _mode = mode
+
+
+def query_shape(statement):
+    """Reduce a SQL statement to its shape."""
+    shape = _STRING.sub("?", statement)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PLACEHOLDER_LIST.sub("(?)", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def start_request():
+    """Start counting the current request's queries, if the detector is on."""
+    if _mode != OFF:
+        g.query_shapes = Counter()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def check_statement(connection, cursor, statement, parameters, context, executemany):
+    """Count a statement against the current request and report repeated shapes."""
+    if not has_request_context() or "query_shapes" not in g:
+        return
+    shape = query_shape(statement)
+    g.query_shapes[shape] += 1
+    count = g.query_shapes[shape]
+    # Report once per shape, when it first crosses the threshold
+    if count != THRESHOLD + 1:
+        return
+    message = f"Possible N+1 in {request.method} {request.path}: query repeated {count} times: {shape}"
+    if _mode == RAISE:
+        raise NPlusOneError(message)
+    logger.warning(message, extra={"shape": shape, "count": count})
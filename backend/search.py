@@ -0,0 +1,174 @@
+"""
+Full-text search over item listings using an SQLite FTS5 index.
+Other databases fall back to matching every word with LIKE.
+"""
+
+import re
+from sqlalchemy import inspect, text
+
+# Columns of Item mirrored into the FTS index, in index column order
+INDEXED_COLUMNS = ("name", "description", "item_type", "color")
+
+# BM25 weights per indexed column; matches in the name count the most
+BM25_WEIGHTS = (10.0, 1.0, 4.0, 2.0)
+
+CREATE_INDEX_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "name, description, item_type, color, tokenize = 'unicode61 remove_diacritics 2')"
+)
+
+_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def is_supported(engine):
+    """Return True if the engine's database supports the FTS5 index."""
+    return engine.dialect.name == "sqlite"
+
+
+def create_index(engine):
+    """Create the FTS table and fill it from the item table if it is out of sync."""
+    if not is_supported(engine):
+        return
+    with engine.begin() as connection:
+        connection.execute(text(CREATE_INDEX_SQL))
+        indexed = connection.execute(text("SELECT count(*) FROM item_fts")).scalar()
+        items = connection.execute(text("SELECT count(*) FROM item")).scalar()
+        if indexed != items:
+            connection.execute(text("DELETE FROM item_fts"))
+            connection.execute(text(
+                "INSERT INTO item_fts(rowid, name, description, item_type, color) "
+                "SELECT id, name, coalesce(description, ''), item_type, coalesce(color, '') FROM item"
+            ))
+
+
+def build_match_query(query):
+    """
+    Turn free text typed by a user into a safe FTS5 MATCH expression.
+    Every word is quoted so FTS operators in the input are treated literally,
+    and the last word is a prefix match so results show up while typing.
+    Args:
+        query (str): The raw search text.
+    Returns:
+        str: The MATCH expression, or None if the text has no searchable words.
+    """
+    terms = _TERM_PATTERN.findall(query or "")
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def search_item_ids(connection, query, category=None, limit=24):
+    """
+    Find the IDs of items matching the query, best BM25 match first.
+    Args:
+        connection: SQLAlchemy connection or session to run the query on.
+        query (str): The raw search text.
+        category (str): Optional category filter.
+        limit (int): Maximum number of IDs to return.
+    Returns:
+        list: Matching item IDs in rank order.
+    """
+    bind = connection.engine if hasattr(connection, "engine") else connection.get_bind()
+    if not is_supported(bind):
+        return _like_item_ids(connection, query, category, limit)
+    match = build_match_query(query)
+    if match is None:
+        return []
+    weights = ", ".join(str(weight) for weight in BM25_WEIGHTS)
+    sql = (
+        "SELECT item_fts.rowid FROM item_fts "
+        "JOIN item ON item.id = item_fts.rowid "
+        "WHERE item_fts MATCH :match"
+    )
+    params = {"match": match, "limit": limit}
+    if category:
+        sql += " AND item.category = :category"
+        params["category"] = category
+    sql += f" ORDER BY bm25(item_fts, {weights}) LIMIT :limit"
+    return [row[0] for row in connection.execute(text(sql), params)]
+
+
+def _like_item_ids(connection, query, category, limit):
+    """Find items containing every word of the query, most ordered first."""
+    terms = _TERM_PATTERN.findall(query or "")
+    if not terms:
+        return []
+    clauses = []
+    params = {"limit": limit}
+    for position, term in enumerate(terms):
+        params[f"term{position}"] = f"%{term.lower()}%"
+        clauses.append(
+            "(" + " OR ".join(
+                f"lower(coalesce(item.{column}, '')) LIKE :term{position}" for column in INDEXED_COLUMNS
+            ) + ")"
+        )
+    sql = "SELECT item.id FROM item WHERE " + " AND ".join(clauses)
+    if category:
+        sql += " AND item.category = :category"
+        params["category"] = category
+    sql += " ORDER BY item.orders DESC, item.id DESC LIMIT :limit"
+    return [row[0] for row in connection.execute(text(sql), params)]
+
+
+def _index_values(target):
+    """Build the parameters for indexing one item."""
+    return {
+        "id": target.id,
+        "name": target.name,
+        "description": target.description or "",
+        "item_type": target.item_type,
+        "color": target.color or "",
+    }
+
+
+def index_items(connection, rows):
+    """Add items inserted without the ORM (e.g. by bulk import) to the index."""
+    connection.execute(
+        text(
+            "INSERT INTO item_fts(rowid, name, description, item_type, color) "
+            "VALUES (:id, :name, :description, :item_type, :color)"
+        ),
+        [
+            {
+                "id": row["id"],
+                "name": row["name"],
+                "description": row.get("description") or "",
+                "item_type": row["item_type"],
+                "color": row.get("color") or "",
+            }
+            for row in rows
+        ],
+    )
+
+
+def on_item_insert(mapper, connection, target):
+    """Mapper hook adding a newly inserted item to the index."""
+    if not is_supported(connection.engine):
+        return
+    connection.execute(
+        text(
+            "INSERT INTO item_fts(rowid, name, description, item_type, color) "
+            "VALUES (:id, :name, :description, :item_type, :color)"
+        ),
+        _index_values(target),
+    )
+
+
+def on_item_update(mapper, connection, target):
+    """Mapper hook re-indexing an item whose text columns changed."""
+    if not is_supported(connection.engine):
+        return
+    state = inspect(target)
+    if not any(state.attrs[column].history.has_changes() for column in INDEXED_COLUMNS):
+        return
+    connection.execute(text("DELETE FROM item_fts WHERE rowid = :id"), {"id": target.id})
+    on_item_insert(mapper, connection, target)
+
+
+def on_item_delete(mapper, connection, target):
+    """Mapper hook removing a deleted item from the index."""
+    if not is_supported(connection.engine):
+        return
+    connection.execute(text("DELETE FROM item_fts WHERE rowid = :id"), {"id": target.id})
@@ -0,0 +1,72 @@
+"""
+Production launcher: serves the API with gunicorn's threaded workers.
+
+Each worker process handles WEB_THREADS requests at once, so a request
+waiting on a slow upload or client only holds one thread while catalog
+reads carry on in the others; calls to imgbb are additionally capped per
+process (IMGBB_MAX_CONCURRENT, a quarter of WEB_THREADS by default) so they
+can never take every thread. Uploads arriving while the cap is reached are
+answered 503 straight away instead of waiting for a slot.
+Put a buffering reverse proxy in front so slow clients are absorbed there
+rather than by worker threads.
+
+Environment:
+    PORT             Port to listen on (default 5001).
+    HOST             Interface to bind (default 0.0.0.0).
+    WEB_CONCURRENCY  Worker processes (default 2 x CPUs + 1, capped at 8).
+    WEB_THREADS      Threads per worker (default 32).
+    IMGBB_MAX_CONCURRENT  imgbb uploads at once per worker (default WEB_THREADS / 4).
+    WEB_TIMEOUT      Seconds before a stuck worker is restarted (default 60).
+
+Usage: python serve.py
+"""
+
+import multiprocessing
+import os
+from gunicorn.app.base import BaseApplication
+
+
+def default_workers():
+    """Workers for this machine; more mostly adds write contention on SQLite."""
+    return min(multiprocessing.cpu_count() * 2 + 1, 8)
+
+
+class Server(BaseApplication):
+    """gunicorn application loading app.py in each worker."""
+
+    def __init__(self, options):
+        """Create the server with gunicorn settings."""
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        """Apply the settings."""
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        """Import the app in the worker, so each one starts its own background threads."""
+        from app import app, start_services
+        start_services()
+        return app
+
+
+def main():
+    """Start gunicorn with settings from the environment."""
+    options = {
+        "bind": f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5001')}",
+        "workers": int(os.environ.get("WEB_CONCURRENCY", default_workers())),
+        "worker_class": "gthread",
+        "threads": int(os.environ.get("WEB_THREADS", "32")),
+        "timeout": int(os.environ.get("WEB_TIMEOUT", "60")),
+        "graceful_timeout": 30,
+        "keepalive": 5,
+        # Not preloaded: the email, digest and certificate threads must start after the fork
+        "preload_app": False,
+        "accesslog": None,
+    }
+    Server(options).run()
+
+
+if __name__ == "__main__":
+    main()
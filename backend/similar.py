@@ -0,0 +1,481 @@
+"""
+"Similar items" recommendations from an in-memory TF-IDF index of the catalog.
+
+Every item becomes a sparse vector of weighted terms: words of its name and
+description, its type, category and color, and a logarithmic price band.
+Similar items are the nearest neighbours by cosine similarity of the
+TF-IDF-weighted vectors, computed for a batch of items with one sparse
+matrix product.
+
+The index is built from the database in a background thread at startup
+and then kept up to date incrementally: committed inserts, updates and
+deletes add, replace or drop single rows. Raw term weights are stored and
+IDF weighting is applied when querying (one sparse product over the raw
+rows), so a change costs its own row and never a pass over the matrix.
+Changes committed by other worker processes are picked up by a background
+rebuild, at most every REFRESH_SECONDS, once the catalog's version counter
+has moved; items those processes created meanwhile are looked up in the
+database when asked for.
+"""
+
+import logging
+import math
+import re
+import threading
+import time
+import numpy as np
+from scipy import sparse
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import object_session
+import versions
+
+# Relative weight of each field in an item's vector
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+TYPE_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.5
+COLOR_WEIGHT = 1.0
+PRICE_WEIGHT = 1.0
+
+# Item columns the vectors are built from; other changes (orders) are ignored
+INDEXED_COLUMNS = ("name", "description", "item_type", "category", "color", "price")
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 50
+REFRESH_SECONDS = 300
+# Retry-After sent while the index is loaded for the first time
+WARMUP_RETRY_SECONDS = 5
+# Rebuild the matrix without deleted rows once this fraction of it is dead
+COMPACT_FRACTION = 0.25
+LOAD_BATCH_SIZE = 5000
+# New rows are kept apart and stacked under the matrix this many at a time
+MERGE_ROWS = 1000
+
+STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "is",
+    "it", "of", "on", "or", "the", "this", "to", "with", "very", "new", "used",
+))
+
+_WORD = re.compile(r"[^\W_]{2,}", re.UNICODE)
+_PENDING_CHANGES = "similar_pending_changes"
+
+logger = logging.getLogger(__name__)
+
+
+def _words(text):
+    """Lowercased words of a text, without stop words."""
+    return [word for word in _WORD.findall((text or "").lower()) if word not in STOP_WORDS]
+
+
+def item_terms(name, description, item_type, category, color, price):
+    """
+    Build the weighted terms of one item.
+    Returns:
+        dict: Term -> weight.
+    """
+    terms = {}
+
+    def add(term, weight):
+        terms[term] = terms.get(term, 0.0) + weight
+
+    for word in _words(name):
+        add(word, NAME_WEIGHT)
+    for word in _words(description):
+        add(word, DESCRIPTION_WEIGHT)
+    if item_type:
+        add("type:" + item_type.lower(), TYPE_WEIGHT)
+    if category:
+        add("category:" + category.lower(), CATEGORY_WEIGHT)
+    if color:
+        add("color:" + color.lower(), COLOR_WEIGHT)
+    if price and price > 0:
+        # Neighbouring bands share half the weight, so close prices stay similar
+        band = int(math.floor(math.log2(price)))
+        add(f"price:{band}", PRICE_WEIGHT)
+        add(f"price:{band - 1}", PRICE_WEIGHT / 2)
+        add(f"price:{band + 1}", PRICE_WEIGHT / 2)
+    return terms
+
+
+def _row_terms(row):
+    """Terms of an object or mapping with the indexed columns."""
+    get = row.get if isinstance(row, dict) else lambda column: getattr(row, column, None)
+    return item_terms(*(get(column) for column in INDEXED_COLUMNS))
+
+
+class IndexNotReady(Exception):
+    """Raised when the index is queried before its first load has finished."""
+
+
+class SimilarityIndex:
+    """
+    Sparse matrix of raw term weights answering top-k cosine queries.
+    IDF weights and row norms are applied when querying, so a change only
+    touches its own row and the document frequencies of its terms.
+    """
+
+    def __init__(self):
+        """Create an empty index; it is loaded in the background by ensure_fresh()."""
+        self._lock = threading.RLock()
+        self._reset()
+        self.loaded = False
+        self.loaded_version = None
+        self.loaded_at = 0.0
+        self._refreshing = False
+        self._replay = None
+
+    def _reset(self):
+        """Clear the matrix and vocabulary."""
+        self.vocabulary = {}
+        self.document_frequency = np.zeros(0, dtype=np.float64)
+        self.matrix = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.squared = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.postings = sparse.csr_matrix((0, 0), dtype=np.float32)
+        self.row_ids = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self.rows = {}
+        self._new_rows = []
+        self._new_alive = []
+        self._pending = None
+        self._norms = None
+
+    def _columns(self, terms):
+        """Map terms to matrix columns, growing the vocabulary as needed."""
+        columns = []
+        for term in terms:
+            column = self.vocabulary.get(term)
+            if column is None:
+                column = self.vocabulary[term] = len(self.vocabulary)
+            columns.append(column)
+        if len(self.vocabulary) > len(self.document_frequency):
+            grown = np.zeros(max(len(self.vocabulary), 2 * len(self.document_frequency)))
+            grown[:len(self.document_frequency)] = self.document_frequency
+            self.document_frequency = grown
+        return columns
+
+    def _add(self, item_id, terms):
+        """Append an item's row to the pending rows, merged into the matrix MERGE_ROWS at a time."""
+        columns = self._columns(terms)
+        self.document_frequency[columns] += 1
+        self._new_rows.append((item_id, columns, list(terms.values())))
+        self._new_alive.append(True)
+        self.rows[item_id] = len(self.row_ids) + len(self._new_rows) - 1
+        self._pending = None
+        self._norms = None
+        if len(self._new_rows) >= MERGE_ROWS:
+            self._merge()
+
+    def _stack(self, rows, width):
+        """Build the raw and squared matrices of (item id, columns, weights) rows."""
+        data, indices, indptr = [], [], [0]
+        for _, columns, weights in rows:
+            indices.extend(columns)
+            data.extend(weights)
+            indptr.append(len(indices))
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(rows), width),
+        )
+        return matrix, matrix.multiply(matrix).tocsr()
+
+    def _merge(self):
+        """Stack the pending rows under the matrix."""
+        if not self._new_rows:
+            return
+        width = len(self.vocabulary)
+        added, added_squared = self._stack(self._new_rows, width)
+        self.matrix = sparse.vstack([_widen(self.matrix, width), added], format="csr")
+        self.squared = sparse.vstack([_widen(self.squared, width), added_squared], format="csr")
+        self.postings = self.matrix.T.tocsr()
+        self.row_ids = np.concatenate([self.row_ids, [item_id for item_id, _, _ in self._new_rows]])
+        self.alive = np.concatenate([self.alive, np.array(self._new_alive, dtype=bool)])
+        self._new_rows = []
+        self._new_alive = []
+        self._pending = None
+        self._norms = None
+
+    def _entries(self, row):
+        """Columns and raw weights of a row, merged or pending."""
+        if row < len(self.row_ids):
+            start, end = self.matrix.indptr[row], self.matrix.indptr[row + 1]
+            return self.matrix.indices[start:end], self.matrix.data[start:end]
+        _, columns, weights = self._new_rows[row - len(self.row_ids)]
+        return columns, weights
+
+    def _remove(self, item_id):
+        """Drop an item's row and its document frequencies."""
+        row = self.rows.pop(item_id, None)
+        if row is None:
+            return
+        columns, _ = self._entries(row)
+        self.document_frequency[columns] -= 1
+        if row < len(self.row_ids):
+            self.alive[row] = False
+        else:
+            self._new_alive[row - len(self.row_ids)] = False
+        self._norms = None
+        total = len(self.row_ids) + len(self._new_rows)
+        if total - len(self.rows) > COMPACT_FRACTION * total:
+            self._compact()
+
+    def _compact(self):
+        """Rebuild the matrix without the deleted rows."""
+        self._merge()
+        self.matrix = self.matrix[self.alive]
+        self.squared = self.squared[self.alive]
+        self.postings = self.matrix.T.tocsr()
+        self.row_ids = self.row_ids[self.alive]
+        self.alive = np.ones(len(self.row_ids), dtype=bool)
+        self.rows = {int(item_id): row for row, item_id in enumerate(self.row_ids)}
+        self._norms = None
+
+    def _idf(self):
+        """IDF weight of every vocabulary term, and of a term no item has."""
+        count = len(self.rows)
+        width = len(self.vocabulary)
+        idf = np.log((1 + count) / (1 + self.document_frequency[:width])) + 1
+        return idf.astype(np.float32), np.float32(math.log(1 + count) + 1)
+
+    def _snapshot(self, idf):
+        """
+        Take what a query needs under the lock: every row as raw weights, the
+        IDF-weighted norms of the rows (cached until the next change), the item
+        IDs and which rows are alive.
+        """
+        if self._pending is None:
+            self._pending = self._stack(self._new_rows, len(self.vocabulary))
+        pending, pending_squared = self._pending
+        if self._norms is None:
+            squared_idf = idf * idf
+            self._norms = np.sqrt(np.concatenate([
+                self.squared @ squared_idf[:self.squared.shape[1]],
+                pending_squared @ squared_idf,
+            ]))
+        row_ids = np.concatenate([self.row_ids, [item_id for item_id, _, _ in self._new_rows]])
+        alive = np.concatenate([self.alive, np.array(self._new_alive, dtype=bool)])
+        return self.postings, pending, self._norms, row_ids, alive
+
+    def _query_vector(self, columns, weights, idf, unseen_weights=(), unseen_idf=0.0):
+        """
+        Turn a query's raw weights into the vector whose product with a raw row
+        is their cosine similarity times the row's norm.
+        """
+        weights = np.asarray(weights, dtype=np.float32)
+        weighted = weights * idf[columns]
+        norm = math.sqrt(float(weighted @ weighted) + sum((weight * unseen_idf) ** 2 for weight in unseen_weights))
+        if not norm:
+            return columns, np.zeros_like(weighted)
+        return columns, weighted * idf[columns] / norm
+
+    def _scores(self, queries, limit, snapshot, excluded):
+        """Rank the rows of a snapshot against query vectors; see similar()."""
+        postings, pending, norms, row_ids, alive = snapshot
+        data, indices, indptr = [], [], [0]
+        for columns, values in queries:
+            indices.extend(columns)
+            data.extend(values)
+            indptr.append(len(indices))
+        vectors = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(queries), pending.shape[1]),
+        )
+        # Queries by rows, only reading the postings of the query terms, then
+        # divided by the row norms; the query norm is already applied
+        products = np.hstack([
+            (vectors[:, :postings.shape[0]] @ postings).toarray(),
+            (vectors @ pending.T).toarray(),
+        ])
+        scale = np.divide(alive, norms, out=np.zeros_like(norms), where=norms > 0)
+        results = []
+        for query, position in enumerate(excluded):
+            row_scores = products[query] * scale
+            if position is not None:
+                row_scores[position] = 0.0
+            count = min(limit, int((row_scores > 0).sum()))
+            if count == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-row_scores, count - 1)[:count]
+            best = best[np.argsort(-row_scores[best], kind="stable")]
+            results.append([int(row_ids[row]) for row in best])
+        return results
+
+    def load(self, engine):
+        """Build the index from every item in the database."""
+        with engine.connect() as connection:
+            version = versions.get_versions(connection, [versions.ALL_ITEMS])[versions.ALL_ITEMS][0]
+            query = select(*(_item_table().c[column] for column in ("id",) + INDEXED_COLUMNS))
+            result = connection.execution_options(yield_per=LOAD_BATCH_SIZE).execute(query)
+            fresh = SimilarityIndex()
+            for row in result:
+                fresh._add(row.id, _row_terms(row._mapping))
+            fresh._merge()
+        with self._lock:
+            self.vocabulary = fresh.vocabulary
+            self.document_frequency = fresh.document_frequency
+            self.matrix = fresh.matrix
+            self.squared = fresh.squared
+            self.postings = fresh.postings
+            self.row_ids = fresh.row_ids
+            self.alive = fresh.alive
+            self.rows = fresh.rows
+            self._new_rows = []
+            self._new_alive = []
+            self._pending = None
+            self._norms = None
+            self.loaded = True
+            self.loaded_version = version
+            self.loaded_at = time.monotonic()
+            # Changes committed while the database was being read
+            replay, self._replay = self._replay, None
+            for changes in replay or ():
+                self._apply(changes)
+
+    def ensure_fresh(self, engine):
+        """
+        Start loading the index in the background if it is not loaded, or
+        refreshing it when other processes changed items. Never waits for it.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            if self.loaded and time.monotonic() - self.loaded_at <= REFRESH_SECONDS:
+                return
+        if self.loaded:
+            with engine.connect() as connection:
+                version = versions.get_versions(connection, [versions.ALL_ITEMS])[versions.ALL_ITEMS][0]
+        with self._lock:
+            if self._refreshing:
+                return
+            if self.loaded and version == self.loaded_version:
+                self.loaded_at = time.monotonic()
+                return
+            self._refreshing = True
+            self._replay = []
+        threading.Thread(target=self._refresh, args=(engine,), name="similar-refresh", daemon=True).start()
+
+    def _refresh(self, engine):
+        """Build from the database, keeping the old index (if any) in service meanwhile."""
+        try:
+            self.load(engine)
+        except Exception:
+            logger.warning("Loading the similar-items index failed", exc_info=True)
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._replay = None
+
+    def _apply(self, changes):
+        """Apply {item id: terms, or None for a deletion} under the lock."""
+        for item_id, terms in changes.items():
+            self._remove(item_id)
+            if terms is not None:
+                self._add(item_id, terms)
+
+    def apply(self, changes):
+        """Apply committed item changes; they are replayed if a load is in progress."""
+        with self._lock:
+            if self._replay is not None:
+                self._replay.append(changes)
+            if self.loaded:
+                self._apply(changes)
+
+    def similar(self, item_ids, limit=DEFAULT_LIMIT):
+        """
+        Find the most similar items for a batch of indexed items.
+        Args:
+            item_ids (list): IDs of the items to find neighbours for.
+            limit (int): Neighbours per item.
+        Returns:
+            dict: Item ID -> list of similar item IDs, best first. Unknown IDs are left out.
+        Raises:
+            IndexNotReady: If the index has not been loaded yet.
+        """
+        with self._lock:
+            if not self.loaded:
+                raise IndexNotReady()
+            known = [item_id for item_id in item_ids if item_id in self.rows]
+            if not known:
+                return {}
+            idf, _ = self._idf()
+            positions = [self.rows[item_id] for item_id in known]
+            queries = [self._query_vector(*self._entries(position), idf) for position in positions]
+            snapshot = self._snapshot(idf)
+        return dict(zip(known, self._scores(queries, limit, snapshot, positions)))
+
+    def similar_to(self, terms, limit=DEFAULT_LIMIT, exclude=None):
+        """
+        Find the items most similar to terms of an item that is not indexed
+        (yet), e.g. one another process created since the last refresh.
+        Args:
+            terms (dict): The item's terms, see item_terms().
+            limit (int): Neighbours to return.
+            exclude (int): Item ID left out of the results.
+        Returns:
+            list: Similar item IDs, best first.
+        Raises:
+            IndexNotReady: If the index has not been loaded yet.
+        """
+        with self._lock:
+            if not self.loaded:
+                raise IndexNotReady()
+            idf, unseen_idf = self._idf()
+            columns = [self.vocabulary[term] for term in terms if term in self.vocabulary]
+            weights = [weight for term, weight in terms.items() if term in self.vocabulary]
+            unseen = [weight for term, weight in terms.items() if term not in self.vocabulary]
+            query = self._query_vector(columns, weights, idf, unseen, unseen_idf)
+            snapshot = self._snapshot(idf)
+            position = self.rows.get(exclude)
+        return self._scores([query], limit, snapshot, [position])[0]
+
+
+def _widen(matrix, width):
+    """The same matrix with width columns, sharing its arrays."""
+    return sparse.csr_matrix((matrix.data, matrix.indices, matrix.indptr), shape=(matrix.shape[0], width))
+
+
+def _item_table():
+    """The item table, imported late to avoid a circular import with db_class."""
+    from db_class import Item
+    return Item.__table__
+
+
+# Shared per-process index
+index = SimilarityIndex()
+
+
+def on_item_change(mapper, connection, target):
+    """Mapper hook queueing an inserted or updated item for the index until commit."""
+    session = object_session(target)
+    if session is None:
+        return
+    state = inspect(target)
+    if state.has_identity and not any(state.attrs[column].history.has_changes() for column in INDEXED_COLUMNS):
+        return
+    session.info.setdefault(_PENDING_CHANGES, {})[target.id] = _row_terms(target)
+
+
+def on_item_delete(mapper, connection, target):
+    """Mapper hook queueing a deleted item's removal from the index until commit."""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_CHANGES, {})[target.id] = None
+
+
+def remember_items(session, rows):
+    """Queue items inserted without the ORM (bulk import) for the index until commit."""
+    pending = session.info.setdefault(_PENDING_CHANGES, {})
+    for row in rows:
+        pending[row["id"]] = _row_terms(row)
+
+
+def on_commit(session):
+    """Session hook applying the committed transaction's item changes to the index."""
+    changes = session.info.pop(_PENDING_CHANGES, None)
+    if changes:
+        index.apply(changes)
+
+
+def on_rollback(session):
+    """Session hook forgetting the changes of a rolled back transaction."""
+    session.info.pop(_PENDING_CHANGES, None)
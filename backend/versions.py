@@ -0,0 +1,74 @@
+"""Modification counters per data partition, used for HTTP conditional requests."""
+
+from datetime import datetime, timezone
+from sqlalchemy import DateTime, bindparam, inspect, text
+
+# Partition covering every item in the catalog
+ALL_ITEMS = "items"
+# Partition covering every user profile, for responses embedding seller summaries
+ALL_USERS = "users"
+# Order and view counters, which only the popularity sorts depend on; bumped
+# by counter flushes instead of the item partitions
+POPULARITY = "popularity"
+
+BUMP_SQL = (
+    "INSERT INTO data_version (scope, version, modified_at) VALUES (:scope, 1, :now) "
+    "ON CONFLICT (scope) DO UPDATE SET version = data_version.version + 1, modified_at = :now"
+)
+
+
+def category_scope(category):
+    """Partition name for the items of one category."""
+    return f"category:{category}"
+
+
+def seller_scope(seller_id):
+    """Partition name for the items of one seller."""
+    return f"seller:{seller_id}"
+
+
+def user_scope(user_id):
+    """Partition name for one user's profile."""
+    return f"user:{user_id}"
+
+
+def bump(connection, scopes):
+    """Increment the counters of the given partitions in the current transaction."""
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    statement = text(BUMP_SQL).bindparams(bindparam("now", type_=DateTime))
+    connection.execute(statement, [{"scope": scope, "now": now} for scope in sorted(scopes)])
+
+
+def get_versions(connection, scopes):
+    """
+    Read the counters of several partitions in one query.
+    Args:
+        connection: SQLAlchemy connection or session to run the query on.
+        scopes (list): Partition names.
+    Returns:
+        dict: scope -> (version, modified_at as an aware UTC datetime or None).
+        Partitions never modified have version 0.
+    """
+    versions = {scope: (0, None) for scope in scopes}
+    query = text(
+        "SELECT scope, version, modified_at FROM data_version WHERE scope IN :scopes"
+    ).bindparams(bindparam("scopes", expanding=True)).columns(modified_at=DateTime)
+    for scope, version, modified_at in connection.execute(query, {"scopes": list(scopes)}):
+        versions[scope] = (version, modified_at.replace(tzinfo=timezone.utc) if modified_at else None)
+    return versions
+
+
+def on_item_change(mapper, connection, target):
+    """Mapper hook bumping every partition an item change is visible in."""
+    state = inspect(target)
+    scopes = {ALL_ITEMS, category_scope(target.category), seller_scope(target.seller_id)}
+    for old_category in state.attrs.category.history.deleted:
+        scopes.add(category_scope(old_category))
+    for old_seller in state.attrs.seller_id.history.deleted:
+        scopes.add(seller_scope(old_seller))
+    bump(connection, scopes)
+
+
+def on_user_change(mapper, connection, target):
+    """Mapper hook bumping a user's partitions when their profile changes."""
+    bump(connection, {user_scope(target.id), ALL_USERS})
@@ -9,7 +9,8 @@
  *   - A function to toggle a product's favorite status.
  * 
  * - The FavoritesProvider:
- *   - Loads favorites from localStorage on initial mount.
+ *   - Loads favorites from localStorage on initial mount and refreshes them
+ *     from the backend with a single batched `/api/products?ids=` request.
  *   - Saves updates to favorites back to localStorage whenever the favorites list changes.
  *   - Provides favorites data and toggleFavorite function to all child components.
  * 
@@ -54,7 +55,19 @@ export const FavoritesProvider = ({ children }: { children: React.ReactNode }) =
     const favData = localStorage.getItem("favorites");
     if (favData) {
       try {
-        setFavorites(JSON.parse(favData));
+        const stored: Product[] = JSON.parse(favData);
+        setFavorites(stored);
+        if (stored.length > 0) {
+          const ids = stored.map((fav) => fav.id).join(",");
+          fetch(`http://localhost:5001/api/products?ids=${ids}`)
+            .then((response) => (response.ok ? response.json() : null))
+            .then((fresh: Product[] | null) => {
+              if (fresh) setFavorites(fresh);
+            })
+            .catch((error) =>
+              console.error("Error refreshing favorites", error)
+            );
+        }
       } catch (error) {
         console.error("Error parsing favorites from localStorage", error);
       }
@@ -50,6 +50,7 @@ export interface Product {
     price: number;
     orders: number;
     image: string;
+    thumbnail?: string;
     type: string;
     color: string;
     category: string;
@@ -407,7 +408,7 @@ export default function ListingsPage({ currentCategory }: ListingsPageProps) {
                             >
                                 {product.image && (
                                     <Image
-                                        src={product.image}
+                                        src={product.thumbnail || product.image}
                                         alt={product.name}
                                         width={300}
                                         height={300}
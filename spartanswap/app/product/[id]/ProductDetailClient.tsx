@@ -4,7 +4,7 @@
  * Client-side component for displaying the details of a single product listing.
  * 
  * Features:
- * - Fetches and displays product information based on the `product_id` from localStorage.
+ * - Fetches and displays product information for `product_id` from the backend API.
  * - Fetches the seller's information (name, email, phone) via an API call.
  * - Displays product attributes: image, name, price, color, type, description.
  * - Allows users to:
@@ -23,7 +23,7 @@
  * - FavoritesContext for managing the global favorites list.
  * 
  * Notes:
- * - Product data is currently retrieved from `localStorage` and synced with the backend API.
+ * - Product data is fetched from `/api/products/<id>` rather than the full listings.
  * - Seller information is dynamically loaded on component mount.
  * - Deleting a listing updates localStorage and calls a backend API to delete server-side data.
  * - Displays appropriate error handling for missing products and failed operations.
@@ -122,13 +122,20 @@ export default function ProductDetailClient({ id: product_id }: { id: string })
       }
     };
 
-    const listings = localStorage.getItem("listings");
-    if (listings) {
-      const arr: Product[] = JSON.parse(listings);
-      const found = arr.find((p) => p.id === Number(product_id)) || null;
-      setProduct(found);
-      if (found) fetchSellerInfo(found.sellerId);
-    }
+    const fetchProduct = async () => {
+      try {
+        const resp = await axios.get<Product>(
+          `http://localhost:5001/api/products/${product_id}`
+        );
+        setProduct(resp.data);
+        fetchSellerInfo(resp.data.sellerId);
+      } catch (e) {
+        console.error(e);
+        setProduct(null);
+      }
+    };
+
+    fetchProduct();
   }, [product_id]);
 
   if (!product) {